@@ -1,4 +1,15 @@
 import sys
-from gui_o_matic.control import GUIPipeControl
 
-GUIPipeControl(sys.stdin).bootstrap()
+
+def main(args=None):
+    args = sys.argv[1:] if (args is None) else args
+    if '--profile-startup' in args:
+        from gui_o_matic import startup
+        startup.enable()
+
+    from gui_o_matic.control import GUIPipeControl
+    GUIPipeControl(sys.stdin).bootstrap()
+
+
+if __name__ == '__main__':
+    main()
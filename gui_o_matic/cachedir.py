@@ -0,0 +1,31 @@
+import os
+import sys
+
+
+def user_cache_dir():
+    """
+    Return the per-user cache directory for gui-o-matic, following the
+    conventions of the platform. The directory may not exist yet.
+    """
+    if os.name == 'nt':
+        base = (os.environ.get('LOCALAPPDATA') or
+                os.environ.get('APPDATA') or os.path.expanduser('~'))
+        return os.path.join(base, 'gui-o-matic', 'Cache')
+    elif sys.platform == 'darwin':
+        return os.path.expanduser('~/Library/Caches/gui-o-matic')
+    else:
+        base = (os.environ.get('XDG_CACHE_HOME') or
+                os.path.expanduser('~/.cache'))
+        return os.path.join(base, 'gui-o-matic')
+
+
+def cache_path(*parts):
+    """
+    Return the path to an entry within the cache directory, creating the
+    directories leading up to it as necessary. Raises OSError on failure.
+    """
+    path = os.path.join(user_cache_dir(), *parts)
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+        os.makedirs(parent, 0700)
+    return path
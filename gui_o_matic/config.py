@@ -0,0 +1,245 @@
+import os
+
+# The stage 1 config is checked once, up front, and compiled into the
+# objects below, so the GUI backends can look things up cheaply later on
+# instead of re-walking (and re-validating) the raw JSON on every update.
+
+
+class ConfigError(ValueError):
+    """Raised with a list of every problem found in a config."""
+    def __init__(self, errors):
+        ValueError.__init__(self, 'Invalid configuration:\n    %s'
+                                  % '\n    '.join(errors))
+        self.errors = errors
+
+
+class FontStyle(object):
+    __slots__ = ('name', 'family', 'points', 'bold', 'italic')
+
+    def __init__(self, name, family='normal', points=12,
+                 bold=False, italic=False):
+        self.name = name
+        self.family = family
+        self.points = points
+        self.bold = bold
+        self.italic = italic
+
+
+class Item(object):
+    """A menu item or main window action."""
+    __slots__ = ('id', 'label', 'sensitive', 'op', 'args', 'type',
+                 'position', 'info')
+
+    def __init__(self, info):
+        self.id = info.get('id')
+        self.label = info.get('label', '')
+        self.sensitive = info.get('sensitive', False)
+        self.op = info.get('op')
+        self.args = info.get('args')
+        self.type = info.get('type', 'button')
+        self.position = info.get('position')
+        self.info = info
+
+
+class StatusDisplay(object):
+    """A status display, with its icon and fonts already looked up."""
+    __slots__ = ('id', 'title', 'details', 'icon', 'fonts')
+
+    def __init__(self, info, icon, fonts):
+        self.id = info['id']
+        self.title = info.get('title', '')
+        self.details = info.get('details', '')
+        self.icon = icon
+        self.fonts = fonts
+
+
+class CompiledConfig(object):
+    __slots__ = ('app_name', 'theme', 'images', 'fonts',
+                 'menu_items', 'action_items', 'items',
+                 'status_displays', 'displays', 'warnings', '_paths')
+
+    def __init__(self, theme):
+        self.app_name = 'gui-o-matic'
+        self.theme = theme
+        self.images = {}
+        self.fonts = {}
+        self.menu_items = []
+        self.action_items = []
+        self.items = {}
+        self.status_displays = []
+        self.displays = {}
+        self.warnings = []
+        self._paths = {}
+
+    def image(self, path):
+        """
+        Resolve an `image:NAME` reference or themed path to an absolute
+        path. Results are remembered, as this is called on every update.
+        """
+        resolved = self._paths.get(path)
+        if resolved is None:
+            if path.startswith('image:'):
+                name = path.split(':', 1)[1]
+                if name not in self.images:
+                    raise KeyError('No such image: %s' % name)
+                resolved = self.images[name]
+            else:
+                resolved = path.replace('%(theme)s', self.theme)
+            if resolved != os.path.abspath(resolved):
+                # The protocol mandates absolute paths, to avoid weird
+                # breakage if the config and GUI app are generated from
+                # different working directories. Fail here to help
+                # developers catch bugs early.
+                raise ValueError('Path is not absolute: %s' % resolved)
+            self._paths[path] = resolved
+        return resolved
+
+    def status_image(self, status):
+        """Return the icon path for a status, falling back to `normal`."""
+        return self.images.get(status) or self.images.get('normal')
+
+    def font_name(self, id, which):
+        """Return the most specific font style for part of an element."""
+        exact = '%s_%s' % (id, which)
+        if exact in self.fonts:
+            return exact
+        return which if (which in self.fonts) else None
+
+    def status_display(self, info, icon=None):
+        """Compile a status display definition."""
+        return StatusDisplay(info, icon, dict(
+            (which, self.font_name(info['id'], which))
+            for which in ('title', 'details')))
+
+
+def _check_image(compiled, errors, where, path):
+    if path is None:
+        return None
+    if not isinstance(path, basestring):
+        errors.append('%s: image must be a string' % where)
+        return None
+    try:
+        return compiled.image(path)
+    except (KeyError, ValueError), e:
+        errors.append('%s: %s' % (where, e.args[0]))
+        return None
+
+
+def _compile_items(compiled, errors, where, items):
+    if not isinstance(items, list):
+        errors.append('%s: must be a list' % where)
+        return []
+    compiled_items = []
+    for i, info in enumerate(items):
+        here = '%s[%d]' % (where, i)
+        if not isinstance(info, dict):
+            errors.append('%s: must be a dictionary' % here)
+            continue
+        item = Item(info)
+        if item.op is not None and not isinstance(item.op, basestring):
+            errors.append('%s: op must be a string' % here)
+        elif item.op and item.op.lower() == 'shell' and not (
+                isinstance(item.args, list) and
+                all(isinstance(a, basestring) for a in item.args)):
+            errors.append('%s: shell args must be a list of strings' % here)
+        compiled_items.append(item)
+        if item.id:
+            compiled.items[item.id] = item
+    return compiled_items
+
+
+def compile_config(config, theme='light'):
+    """
+    Check a stage 1 config and compile it for use by a GUI backend.
+    Raises a ConfigError listing all the problems found, if any.
+
+    Bad entries in the `images` and `font_styles` tables are only warnings
+    (in compiled.warnings), and are left out: unused ones did no harm
+    before they were checked up front, and using one is still an error.
+    """
+    if not isinstance(config, dict):
+        raise ConfigError(['Configuration must be a dictionary'])
+
+    errors = []
+    compiled = CompiledConfig(theme)
+    compiled.app_name = config.get('app_name', compiled.app_name)
+    if not isinstance(compiled.app_name, basestring):
+        errors.append('app_name: must be a string')
+
+    warnings = compiled.warnings
+    images = config.get('images', {})
+    if not isinstance(images, dict):
+        warnings.append('images: must be a dictionary')
+        images = {}
+    for name, path in images.iteritems():
+        if not isinstance(path, basestring):
+            warnings.append('images.%s: must be a string' % name)
+            continue
+        path = path.replace('%(theme)s', theme)
+        if path != os.path.abspath(path):
+            warnings.append('images.%s: Path is not absolute: %s'
+                            % (name, path))
+            continue
+        compiled.images[name] = path
+
+    fonts = config.get('font_styles', {})
+    if not isinstance(fonts, dict):
+        warnings.append('font_styles: must be a dictionary')
+        fonts = {}
+    for name, style in fonts.iteritems():
+        if not isinstance(style, dict):
+            warnings.append('font_styles.%s: must be a dictionary' % name)
+            continue
+        if not isinstance(style.get('points', 12), (int, long, float)):
+            warnings.append('font_styles.%s: points must be a number' % name)
+            continue
+        try:
+            compiled.fonts[name] = FontStyle(name, **style)
+        except TypeError:
+            warnings.append('font_styles.%s: unknown style attributes'
+                            % name)
+
+    _check_image(compiled, errors, 'app_icon', config.get('app_icon'))
+
+    splash = config.get('splash_screen')
+    if splash is not None:
+        if isinstance(splash, dict):
+            _check_image(compiled, errors, 'splash_screen.background',
+                         splash.get('background'))
+        else:
+            errors.append('splash_screen: must be a dictionary')
+
+    indicator = config.get('indicator', {})
+    if isinstance(indicator, dict):
+        compiled.menu_items = _compile_items(
+            compiled, errors, 'indicator.menu_items',
+            indicator.get('menu_items', []))
+    else:
+        errors.append('indicator: must be a dictionary')
+
+    wcfg = config.get('main_window', {})
+    if isinstance(wcfg, dict):
+        _check_image(compiled, errors, 'main_window.background',
+                     wcfg.get('background'))
+        compiled.action_items = _compile_items(
+            compiled, errors, 'main_window.action_items',
+            wcfg.get('action_items', []))
+        displays = wcfg.get('status_displays', [])
+        if not isinstance(displays, list):
+            errors.append('main_window.status_displays: must be a list')
+            displays = []
+        for i, info in enumerate(displays):
+            where = 'main_window.status_displays[%d]' % i
+            if not isinstance(info, dict) or 'id' not in info:
+                errors.append('%s: must be a dictionary with an id' % where)
+                continue
+            display = compiled.status_display(info, _check_image(
+                compiled, errors, where + '.icon', info.get('icon')))
+            compiled.status_displays.append(display)
+            compiled.displays[display.id] = display
+    else:
+        errors.append('main_window: must be a dictionary')
+
+    if errors:
+        raise ConfigError(errors)
+    return compiled
@@ -1,12 +1,56 @@
-import json
+import errno
 import os
+import pipes
+import select
+import shutil
 import subprocess
 import socket
+import tempfile
 import time
 import threading
 import traceback
 import urllib2
-from gui_o_matic.gui.auto import AutoGUI
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows
+from gui_o_matic import startup
+from gui_o_matic.config import ConfigError
+from gui_o_matic.control import codec
+from gui_o_matic.control.coalesce import CoalescingDispatcher
+from gui_o_matic.control.errors import ErrorReporter
+from gui_o_matic.control.reader import (
+    FrameReader, LineReader, LinePoller, can_poll)
+from gui_o_matic.control.shm import ShmReader
+from gui_o_matic.gui.auto import AutoGUI, preload
+
+
+def _inherit_only(keep):
+    """
+    Mark every file descriptor beyond stdio close-on-exec, except `keep`,
+    so a child started with Popen(close_fds=False) inherits only that one.
+
+    This runs in the parent (as Python 3 does by default, the other fds
+    stay close-on-exec); listing /dev/fd in a preexec_fn, between fork()
+    and exec(), is not safe in a threaded program.
+    """
+    try:
+        # List what is actually open, if the platform lets us
+        fds = [int(fd) for fd in os.listdir('/dev/fd')]
+    except (OSError, ValueError):
+        fds = range(3, subprocess.MAXFD)
+    for fd in fds:
+        if fd <= 2:
+            continue
+        try:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+            if fd == keep:
+                flags &= ~fcntl.FD_CLOEXEC
+            else:
+                flags |= fcntl.FD_CLOEXEC
+            fcntl.fcntl(fd, fcntl.F_SETFD, flags)
+        except (IOError, OSError):
+            pass
 
 
 class GUIPipeControl(threading.Thread):
@@ -15,47 +59,144 @@ class GUIPipeControl(threading.Thread):
     OK_LISTEN_TO = 'OK LISTEN TO:'
     OK_LISTEN_TCP = 'OK LISTEN TCP:'
     OK_LISTEN_HTTP = 'OK LISTEN HTTP:'
+    OK_LISTEN_UNIX = 'OK LISTEN UNIX:'
+    OK_LISTEN_FD = 'OK LISTEN FD:'
+    OK_LISTEN_SHM = 'OK LISTEN SHM:'
+    OK_LISTEN_FRAMED = 'OK LISTEN FRAMED'
+
+    # Report at most one error (or summary of errors) per this many seconds
+    ERROR_PERIOD = 5.0
+
+    # Seconds to keep the GUI up after a fatal error, so it can be read
+    FATAL_LINGER = 30
+
+    # Seconds to wait for a connection after OK LISTEN TCP/HTTP, and how
+    # often to check if the child is still alive where we cannot wait for
+    # that directly (Windows).
+    ACCEPT_TIMEOUT = 60
+    CHILD_POLL = 0.1
+
+    # How many times per second to sample the shared memory channel
+    SHM_RATE = 30
 
-    def __init__(self, fd, config=None, gui_object=None):
+    def __init__(self, fd, config=None, gui_object=None,
+                 event_driven=None, coalesce=True, accept_timeout=None):
         threading.Thread.__init__(self)
         self.daemon = True
-        self.config = config
+        self.config = None
+        self.codec, self.decode = codec.DEFAULT, codec.decode
+        self._set_config(config)
         self.gui = gui_object
         self.sock = None
-        self.fd = fd
+        if event_driven is None:
+            event_driven = can_poll(fd)
+        self.event_driven = event_driven
+        self.fd = self._reader(fd)
+        self.coalesce = coalesce
+        self.coalescer = None
         self.child = None
         self.listening = None
+        self.accept_timeout = accept_timeout or self.ACCEPT_TIMEOUT
+        self.shm = None
+        self.sampler = None
+        self.decode_frame = None
+        self.errors = ErrorReporter(self._report_error,
+                                    period=self.ERROR_PERIOD,
+                                    dispatch=self._report_idle)
+
+    def _report_error(self, e):
+        if self.gui:
+            self.gui._report_error(e)
+        else:
+            traceback.print_exc()
+
+    def _report_idle(self, callback):
+        if self.gui:
+            self.gui._idle(callback)
+        else:
+            callback()
+
+    def _set_config(self, config):
+        self.config = config
+        if config and config.get('json_codec', self.codec) != self.codec:
+            self.codec, self.decode = codec.decoder(config['json_codec'])
+
+    def _reader(self, fd):
+        """
+        In event-driven mode we bypass Python's buffered file objects
+        entirely, so no data gets stuck in a buffer we cannot poll.
+        """
+        if self.event_driven:
+            return LineReader(fd)
+        return fd
 
-    def shell_pivot(self, command):
+    def shell_pivot(self, command, **popen_args):
+        popen_args.setdefault('close_fds', os.name != 'nt') # Doesn't work on windows!
         self.child = subprocess.Popen(command,
             shell=True,
-            close_fds= (os.name != 'nt'), # Doesn't work on windows!
             stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE)
-        self.fd = self.child.stdout
+            stdout=subprocess.PIPE,
+            **popen_args)
+        self.fd = self._reader(self.child.stdout)
 
-    def _listen(self):
-        self.listening = socket.socket()
-        self.listening.bind(('127.0.0.1', 0))
+    def _listen(self, family=socket.AF_INET, address=('127.0.0.1', 0)):
+        self.listening = socket.socket(family, socket.SOCK_STREAM)
+        self.listening.bind(address)
         self.listening.listen(0)
-        return str(self.listening.getsockname()[1])
+        if family == socket.AF_INET:
+            return str(self.listening.getsockname()[1])
+        return address
 
     def _accept(self):
-        if self.child is not None:
-            self.listening.settimeout(1)
-            for count in range(0, 60):
-                try:
-                    self.sock = self.listening.accept()[0]
+        """
+        Wait for a connection to our listening socket, giving up after
+        accept_timeout seconds. If we launched a child, we also watch its
+        stdout: it hitting EOF means the child has probably exited, in
+        which case we fail right away with its exit status (unless it
+        connected first).
+        """
+        deadline = time.time() + self.accept_timeout
+        watching = []
+        if self.child is not None and can_poll(self.child.stdout):
+            watching.append(self.child.stdout)
+        while True:
+            if self.child is not None and self.child.poll() is not None:
+                # A quick child may have connected, sent everything and
+                # exited since we last looked; that is not an error.
+                if select.select([self.listening], [], [], 0)[0]:
                     break
-                except socket.timeout:
-                    pass
-        else:
-            self.listening.settimeout(60)
-            self.sock = self.listening.accept()[0]
+                raise OSError('Child exited with status %d before connecting'
+                              % self.child.returncode)
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                raise socket.timeout('No connection within %gs'
+                                     % self.accept_timeout)
+            if self.child is not None and not watching:
+                # Cannot wait for the child to exit, so check periodically
+                timeout = min(timeout, self.CHILD_POLL)
+            try:
+                readable = select.select(
+                    [self.listening] + watching, [], [], timeout)[0]
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if self.listening in readable:
+                break
+            for pipe in readable:
+                # Output from the child before it connects is discarded.
+                if not os.read(pipe.fileno(), 4096):
+                    watching.remove(pipe)
+        self._use_socket(self.listening.accept()[0])
 
+    def _use_socket(self, sock):
+        self.sock = sock
         # https://stackoverflow.com/questions/19570672/non-blocking-error-when-adding-timeout-to-python-server
         self.sock.setblocking(True)
-        self.fd = self.sock.makefile()
+        if self.event_driven:
+            self.fd = LineReader(self.sock)
+        else:
+            self.fd = self.sock.makefile()
 
     def shell_tcp_pivot(self, command):
         port = self._listen()
@@ -67,6 +208,82 @@ class GUIPipeControl(threading.Thread):
         urllib2.urlopen(url.replace('%PORT%', port)).read()
         self._accept()
 
+    def shell_unix_pivot(self, command):
+        """
+        Like shell_tcp_pivot, but listen on a Unix domain socket in a new
+        private (mode 0700) directory, so only our user can connect.
+        """
+        if not hasattr(socket, 'AF_UNIX'):
+            raise OSError('Unix domain sockets are not supported here')
+        sock_dir = tempfile.mkdtemp(prefix='gui-o-matic-')
+        try:
+            path = self._listen(socket.AF_UNIX,
+                                os.path.join(sock_dir, 'control.sock'))
+            self.shell_pivot(command.replace('%SOCKET%', pipes.quote(path)))
+            self._accept()
+        finally:
+            # Once connected, the socket no longer needs a name
+            if self.listening is not None:
+                self.listening.close()
+                self.listening = None
+            shutil.rmtree(sock_dir, ignore_errors=True)
+
+    def shell_fd_pivot(self, command):
+        """
+        Launch the command with one end of a socketpair as an inherited
+        file descriptor (substituted for %FD%), and read from the other.
+        """
+        if os.name == 'nt':
+            raise OSError('Passing file descriptors is not supported here')
+        ours, theirs = socket.socketpair()
+        try:
+            _inherit_only(theirs.fileno())
+            self.shell_pivot(command.replace('%FD%', str(theirs.fileno())),
+                             close_fds=False)
+        except:
+            ours.close()
+            raise
+        finally:
+            theirs.close()
+        self._use_socket(ours)
+
+    def framed_pivot(self, frame_codec):
+        """
+        Switch the current source over to length-prefixed frames, each
+        holding a [command, {arguments}] list.
+        """
+        ignored, self.decode_frame = codec.frame_decoder(frame_codec,
+                                                         self.decode)
+        self.fd = FrameReader(self.fd)
+
+    def shm_attach(self, path):
+        """
+        Start sampling a shared memory update channel (see control/shm.py),
+        in addition to reading commands from the current source.
+        """
+        shm, self.shm = self.shm, ShmReader(path)
+        if shm is not None:
+            shm.close()
+        if self.gui is not None and self.gui.ready:
+            self._start_sampler()
+
+    def _start_sampler(self):
+        if self.shm is not None and self.sampler is None:
+            self.sampler = threading.Thread(target=self._run_sampler,
+                                            name='shm-sampler')
+            self.sampler.daemon = True
+            self.sampler.start()
+
+    def _run_sampler(self):
+        interval = 1.0 / self.SHM_RATE
+        while True:
+            time.sleep(interval)
+            try:
+                for command, kwargs in self.shm.sample():
+                    self.do(command, kwargs)
+            except Exception, e:
+                self.errors.error('shm', e)
+
     def do_line_magic(self, line, listen):
         try:
             if not line or line.strip() in (self.OK_GO, self.OK_LISTEN):
@@ -84,18 +301,37 @@ class GUIPipeControl(threading.Thread):
                 self.http_tcp_pivot(line[len(self.OK_LISTEN_HTTP):].strip())
                 return True, True
 
+            elif line.startswith(self.OK_LISTEN_UNIX):
+                self.shell_unix_pivot(line[len(self.OK_LISTEN_UNIX):].strip())
+                return True, True
+
+            elif line.startswith(self.OK_LISTEN_FD):
+                self.shell_fd_pivot(line[len(self.OK_LISTEN_FD):].strip())
+                return True, True
+
+            elif line.startswith(self.OK_LISTEN_FRAMED):
+                self.framed_pivot(
+                    line[len(self.OK_LISTEN_FRAMED):].lstrip(':').strip())
+                return True, True
+
+            elif line.startswith(self.OK_LISTEN_SHM):
+                self.shm_attach(line[len(self.OK_LISTEN_SHM):].strip())
+                return True, True
+
             else:
                 return False, listen
         except Exception, e:
             if self.gui:
-                self.gui._report_error(e)
-                time.sleep(30)
-                raise
+                self.errors.fatal(e)
+            raise
 
     def bootstrap(self, dry_run=False):
         assert(self.config is None)
         assert(self.gui is None)
 
+        # Import the GUI while we wait for the config
+        preloader = None if dry_run else preload()
+
         listen = False
         config = []
         while True:
@@ -107,53 +343,170 @@ class GUIPipeControl(threading.Thread):
             else:
                 config.append(line.strip())
 
-        self.config = json.loads(''.join(config))
-        self.gui = AutoGUI(self.config)
+        with startup.timed('decode config'):
+            self._set_config(self.decode(''.join(config)))
+        with startup.timed('AutoGUI'):
+            if preloader is not None:
+                preloader.join()
+            try:
+                self.gui = AutoGUI(self.config)
+            except ConfigError, e:
+                # There is no GUI to show this in yet; like other stage 1
+                # failures, report it and give up.
+                print('%s' % e)
+                raise SystemExit(1)
         if not dry_run:
             if listen:
                 self.start()
             self.gui.run()
 
-    def do(self, command, kwargs):
-        if hasattr(self.gui, command):
-            getattr(self.gui, command)(**kwargs)
+    def _dispatch(self, command, kwargs):
+        getattr(self.gui, command)(**kwargs)
+
+    def do_batch(self, commands):
+        """
+        Apply a list of [command, {args}] pairs. The whole batch is checked
+        before anything is applied, so a malformed batch has no effect.
+        The batch is not applied atomically: coalescable updates are
+        applied together, but any other command acts as a barrier (see
+        CoalescingDispatcher), splitting the batch, and without a coalescer
+        each command is dispatched on its own.
+        """
+        if not isinstance(commands, list):
+            raise ValueError('Batch must be a list')
+        batch = []
+        for entry in commands:
+            if (not isinstance(entry, list) or not 1 <= len(entry) <= 2
+                    or not isinstance(entry[0], basestring)):
+                raise ValueError('Invalid batch entry: %s' % (entry,))
+            command, kwargs = entry[0], (entry[1:] or [{}])[0]
+            if not isinstance(kwargs, dict):
+                raise ValueError('Invalid arguments for %s' % command)
+            if not hasattr(self.gui, command):
+                raise ValueError('Unknown method: %s' % command)
+            batch.append((command, kwargs))
+
+        if self.coalescer is not None:
+            self.coalescer.submit_many(batch)
         else:
+            for command, kwargs in batch:
+                self._dispatch(command, kwargs)
+
+    def do(self, command, kwargs):
+        if command == 'batch':
+            self.do_batch(kwargs)
+        elif not isinstance(kwargs, dict):
+            raise ValueError('Invalid arguments for %s' % command)
+        elif not hasattr(self.gui, command):
             print('Unknown method: %s' % command)
+        elif self.coalescer is not None:
+            self.coalescer.submit(command, kwargs)
+        else:
+            self._dispatch(command, kwargs)
+
+    def do_line(self, line):
+        match, lstn = self.do_line_magic(line, None)
+        if not match:
+            try:
+                cmd, args = line.strip().split(' ', 1)
+                args = self.decode(args)
+            except (ValueError, IndexError, NameError), e:
+                self.errors.error('parse', e)
+                return
+            try:
+                self.do(cmd, args)
+            except Exception, e:
+                self.errors.error('command', e)
+
+    def do_frame(self, frame):
+        try:
+            cmd, args = self.decode_frame(frame)
+            if not isinstance(cmd, basestring):
+                raise ValueError('Invalid command: %s' % (cmd,))
+        except (ValueError, TypeError), e:
+            self.errors.error('parse', e)
+            return
+        try:
+            self.do(cmd, args)
+        except Exception, e:
+            self.errors.error('command', e)
+
+    def do_input(self, data):
+        """Process a line, or a frame once we have switched to framing."""
+        if self.decode_frame is not None:
+            self.do_frame(data)
+        else:
+            self.do_line(data)
+
+    def do_lines(self, lines):
+        """
+        Process a batch of lines (or frames). If one of them switches us
+        over to a new source, the rest of the batch is dropped, just as we
+        would stop reading from the old source in line-by-line mode. If we
+        only switched to framing, the rest is handed back to be reframed.
+        """
+        source = self.fd
+        for i, line in enumerate(lines):
+            self.do_input(line)
+            if self.fd is not source:
+                rest = lines[i + 1:]
+                if rest and getattr(self.fd, 'previous', None) is source:
+                    self.fd.unread(''.join(rest))
+                break
+
+    def _run_readline(self):
+        while True:
+            try:
+                line = self.fd.readline()
+            except IOError as e:
+                line = None
+
+            if not line:
+                break
+            self.do_input(line)
+
+    def _run_event_driven(self):
+        source = self.fd
+        poller = LinePoller(source)
+        while not source.eof:
+            try:
+                batches = poller.poll()
+            except (IOError, OSError):
+                break
+            for reader, lines in batches:
+                if reader is source:
+                    self.do_lines(lines)
+            if self.fd is not source:
+                poller.unregister(source)
+                source = self.fd
+                poller.register(source)
 
     def run(self):
         try:
-            while not self.gui.ready:
-                time.sleep(0.1)
-            time.sleep(0.1)
-            while True:
-                try:
-                    line = self.fd.readline()
-                except IOError as e:
-                    line = None
-
-                if not line:
-                    break
-                if line:
-                    match, lstn = self.do_line_magic(line, None)
-                    if not match:
-                        try:
-                            cmd, args = line.strip().split(' ', 1)
-                            args = json.loads(args)
-                            self.do(cmd, args)
-                        except (ValueError, IndexError, NameError), e:
-                            if self.gui:
-                                self.gui._report_error(e)
-                                time.sleep(30)
-                            else:
-                                traceback.print_exc()
+            self.gui._wait_until_ready()
+            if self.coalesce:
+                self.coalescer = CoalescingDispatcher(
+                    self.gui, self._dispatch, errors=self.errors)
+            self._start_sampler()
+            if self.event_driven:
+                self._run_event_driven()
+            else:
+                self._run_readline()
 
         except KeyboardInterrupt:
             return
         except:
             traceback.print_exc()
         finally:
-            # Use sys.exit to allow atxit.register() to fire...
-            #
-            self.gui.quit()
-            time.sleep(0.5)
-            os._exit(0)
+            self._shutdown()
+
+    def _shutdown(self):
+        # Leave any fatal error on screen for a while, then exit.
+        # Use sys.exit to allow atxit.register() to fire...
+        #
+        self.errors.cancel()
+        if self.errors.fatal_error is not None:
+            time.sleep(self.FATAL_LINGER)
+        self.gui.quit()
+        time.sleep(0.5)
+        os._exit(0)
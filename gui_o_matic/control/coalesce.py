@@ -0,0 +1,143 @@
+import threading
+from collections import OrderedDict
+
+
+class CoalescingDispatcher(object):
+    """
+    Sits between GUIPipeControl and the GUI, merging redundant updates.
+
+    Commands listed in COALESCE only ever describe the latest state of
+    something (the splash progress, the label of a menu item, ...), so if
+    several arrive before the GUI gets around to applying them, only the
+    most recent value per (method, id) key matters. Arguments are merged,
+    so a set_item label followed by a set_item sensitivity change for the
+    same id still applies both.
+
+    Pending updates are flushed once per main-loop iteration, using the
+    GUI's _idle() hook. Any other command acts as a barrier: pending updates
+    are flushed first, so ordering relative to it is preserved.
+
+    Batches submitted with submit_many() are never split across flushes.
+
+    Errors raised while applying updates are passed to `errors` (an
+    ErrorReporter) if given, so they are rate-limited along with the rest.
+    """
+    # Method name -> argument which identifies the thing being updated,
+    # or None if there is only one of them.
+    COALESCE = {
+        'set_status': None,
+        'set_item': 'id',
+        'set_status_display': 'id',
+        'update_splash_screen': None}
+
+    # Methods which some GUIs apply empty values for, and others ignore.
+    # An empty value cannot be merged over a pending non-empty one without
+    # changing what one or the other shows, so it gets a flush instead.
+    IGNORES_EMPTY = set(['set_status_display'])
+
+    def __init__(self, gui, dispatch, errors=None):
+        self.gui = gui
+        self.dispatch = dispatch
+        self.errors = errors
+        self.lock = threading.Lock()
+        self.flush_lock = threading.RLock()
+        self.pending = OrderedDict()
+        self.scheduled = False
+        self.holding = 0
+        self.submitted = 0
+        self.superseded = 0
+        self.flushes = 0
+
+    def stats(self):
+        return {
+            'submitted': self.submitted,
+            'superseded': self.superseded,
+            'flushes': self.flushes,
+            'pending': len(self.pending)}
+
+    def submit(self, command, kwargs):
+        if command not in self.COALESCE:
+            self.flush()
+            self.dispatch(command, kwargs)
+            return
+
+        id_arg = self.COALESCE[command]
+        key = (command, kwargs.get(id_arg) if id_arg else None)
+        if command in self.IGNORES_EMPTY:
+            with self.lock:
+                pending = self.pending.get(key, {})
+                clobbers = [k for k, v in kwargs.iteritems()
+                            if not v and v is not None and pending.get(k)]
+            if clobbers:
+                self.flush()
+
+        with self.lock:
+            self.submitted += 1
+            if key in self.pending:
+                # None means "leave unchanged", so must not clobber values
+                # from the update we are superseding.
+                self.pending[key].update((k, v) for k, v in kwargs.iteritems()
+                                         if v is not None)
+                self.superseded += 1
+            else:
+                self.pending[key] = dict(kwargs)
+            schedule = not (self.scheduled or self.holding)
+            if schedule:
+                self.scheduled = True
+
+        if schedule:
+            self.gui._idle(self._scheduled_flush)
+
+    def submit_many(self, commands):
+        """
+        Submit a list of (command, kwargs) pairs. All coalescable updates
+        in the list are applied together, by a single main-loop callback.
+        """
+        with self.lock:
+            self.holding += 1
+        try:
+            for command, kwargs in commands:
+                self.submit(command, kwargs)
+        finally:
+            with self.lock:
+                self.holding -= 1
+                schedule = (self.pending and
+                            not (self.scheduled or self.holding))
+                if schedule:
+                    self.scheduled = True
+            if schedule:
+                self.gui._idle(self._scheduled_flush)
+
+    def _scheduled_flush(self):
+        with self.flush_lock:
+            with self.lock:
+                if self.holding:
+                    # A batch is being submitted; it will reschedule us when
+                    # it is complete.
+                    self.scheduled = False
+                    return
+                pending = self._take()
+            self._apply(pending)
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                pending = self._take()
+            self._apply(pending)
+
+    def _take(self):
+        pending, self.pending = self.pending, OrderedDict()
+        self.scheduled = False
+        return pending
+
+    def _apply(self, pending):
+        if pending:
+            self.flushes += 1
+        for (command, _), kwargs in pending.iteritems():
+            try:
+                self.dispatch(command, kwargs)
+            except Exception, e:
+                if self.errors is not None:
+                    self.errors.error('command', e)
+                else:
+                    self.gui._report_error(e)
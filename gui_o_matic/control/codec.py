@@ -0,0 +1,99 @@
+import json
+
+
+def _load_ujson():
+    import ujson
+    return ujson.loads
+
+
+def _load_simplejson():
+    import simplejson
+    # Without the C speedups simplejson is slower than the stdlib
+    import simplejson._speedups
+    return simplejson.loads
+
+
+def _load_json():
+    return json.loads
+
+
+# Note: This is NOT dict, because order matters: fastest first.
+#
+_registry = (
+    ('ujson',      _load_ujson),
+    ('simplejson', _load_simplejson),
+    ('json',       _load_json),
+)
+
+
+def available_codecs():
+    '''
+    List the names of the JSON codecs which can be used on this machine.
+    '''
+    available = []
+    for name, loader in _registry:
+        try:
+            loader()
+            available.append(name)
+        except ImportError:
+            pass
+    return available
+
+
+def _strict(loads, what='JSON'):
+    '''
+    Make a third party decoder raise ValueError on all bad input, just like
+    the stdlib does, so error handling stays the same whatever we use.
+    '''
+    def decode(data):
+        try:
+            return loads(data)
+        except ValueError:
+            raise
+        except Exception, e:
+            raise ValueError('Invalid %s: %s' % (what, e))
+    return decode
+
+
+def decoder(name=None):
+    '''
+    Return a (name, decode) tuple for the named codec, or for the fastest
+    available codec if no name is given or the named one is unavailable.
+    '''
+    for codec, loader in _registry:
+        if name and codec != name:
+            continue
+        try:
+            loads = loader()
+            return codec, (loads if codec == 'json' else _strict(loads))
+        except ImportError:
+            if name:
+                print('JSON codec unavailable: %s' % name)
+                return decoder()
+    if name:
+        print('Unknown JSON codec: %s' % name)
+        return decoder()
+
+
+def _load_msgpack():
+    import msgpack
+    return lambda data: msgpack.unpackb(data, raw=False)
+
+
+def frame_decoder(name=None, json_decode=None):
+    '''
+    Return a (name, decode) tuple for the payloads of OK LISTEN FRAMED mode:
+    compact JSON (the default, using json_decode if given) or MessagePack.
+    Raises ValueError if the codec is unknown or unavailable.
+    '''
+    if not name or name == 'json':
+        return 'json', json_decode or decode
+    elif name == 'msgpack':
+        try:
+            return name, _strict(_load_msgpack(), 'MessagePack')
+        except ImportError:
+            raise ValueError('Frame codec unavailable: %s' % name)
+    raise ValueError('Unknown frame codec: %s' % name)
+
+
+DEFAULT, decode = decoder()
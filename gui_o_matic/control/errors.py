@@ -0,0 +1,93 @@
+import threading
+import time
+
+
+class RepeatedErrors(Exception):
+    """A summary of errors which were not reported individually."""
+    def __init__(self, kind, count, period):
+        Exception.__init__(self, '%d %s error%s in last %gs' % (
+            count, kind, '' if count == 1 else 's', period))
+        self.kind = kind
+        self.count = count
+
+
+class ErrorReporter(object):
+    """
+    Reports errors in the command stream, without ever blocking the reader.
+
+    The first error is reported right away. Further errors within `period`
+    seconds are only counted, and reported as a summary per kind (e.g.
+    "37 parse errors in last 5s") by a trailing timer, so a flood of bad
+    input produces one message per period. Summaries go through dispatch(),
+    so toolkits can keep them on the GUI thread.
+    """
+    def __init__(self, report, period=5.0, dispatch=None):
+        self.report = report
+        self.period = period
+        self.dispatch = dispatch or (lambda callback: callback())
+        self.lock = threading.Lock()
+        self.window_end = 0
+        self.suppressed = {}
+        self.counts = {}
+        self.timer = None
+        self.reported = 0
+        self.fatal_error = None
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+            stats['reported'] = self.reported
+            stats['suppressed'] = sum(self.suppressed.values())
+        return stats
+
+    def error(self, kind, e):
+        """
+        Count an error, reporting it unless one was reported recently.
+        Call this from the except clause, so the traceback gets logged.
+        """
+        with self.lock:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+            now = time.time()
+            if now >= self.window_end:
+                self.window_end = now + self.period
+                self.reported += 1
+                report = True
+            else:
+                self.suppressed[kind] = self.suppressed.get(kind, 0) + 1
+                report = False
+                if self.timer is None:
+                    self.timer = threading.Timer(
+                        self.window_end - now, self.dispatch, [self.flush])
+                    self.timer.daemon = True
+                    self.timer.start()
+        if report:
+            self.report(e)
+
+    def fatal(self, e):
+        """Report an error we are about to exit because of."""
+        with self.lock:
+            self.counts['fatal'] = self.counts.get('fatal', 0) + 1
+            self.reported += 1
+            self.fatal_error = e
+        self.report(e)
+
+    def flush(self):
+        """Report summaries of any errors held back since the last report."""
+        with self.lock:
+            self.timer = None
+            summaries = [RepeatedErrors(kind, count, self.period)
+                         for kind, count in sorted(self.suppressed.items())]
+            self.suppressed = {}
+            if summaries:
+                # Summaries count as a report, so start a new window
+                self.window_end = time.time() + self.period
+                self.reported += len(summaries)
+        for summary in summaries:
+            self.report(summary)
+
+    def cancel(self):
+        with self.lock:
+            self.suppressed = {}
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
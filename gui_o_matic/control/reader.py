@@ -0,0 +1,300 @@
+import errno
+import os
+import select
+import struct
+
+
+def can_poll(fd):
+    """
+    Check whether a file-like object can be used with the event-driven
+    reader. This requires a real file descriptor and a platform where
+    select() works on pipes (so not Windows).
+    """
+    if os.name == 'nt':
+        return False
+    try:
+        return isinstance(fd.fileno(), int)
+    except (AttributeError, IOError, ValueError):
+        return False
+
+
+class LineReader(object):
+    """
+    Read lines from a pipe, socket or file without going through Python's
+    buffered file objects. Data is read in large chunks and split into
+    lines incrementally; lines keep their trailing newline, just like
+    readline() does, and an empty list is returned at end of file.
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, source):
+        self.source = source
+        self.buffer = ''
+        self.pending = []
+        self.eof = False
+        if hasattr(source, 'recv'):
+            self._read = source.recv
+        else:
+            fileno = source.fileno()
+            self._read = lambda count: os.read(fileno, count)
+
+    def fileno(self):
+        return self.source.fileno()
+
+    def feed(self, data):
+        """
+        Add data to our buffer, returning a list of all complete lines.
+        Feeding an empty string signals end of file and flushes any
+        trailing partial line.
+        """
+        if not data:
+            self.eof = True
+            lines, self.buffer = ([self.buffer] if self.buffer else []), ''
+            return lines
+
+        last_nl = data.rfind('\n')
+        if last_nl < 0:
+            self.buffer += data
+            return []
+
+        lines = (self.buffer + data[:last_nl]).split('\n')
+        self.buffer = data[last_nl + 1:]
+        return [line + '\n' for line in lines]
+
+    def read_chunk(self):
+        """
+        Perform a single read and return the resulting complete lines.
+        This will block if the source is not ready.
+        """
+        while True:
+            try:
+                return self.feed(self._read(self.CHUNK_SIZE))
+            except (IOError, OSError) as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno in (errno.ECONNRESET, errno.EPIPE):
+                    return self.feed('')
+                raise
+
+    def read_lines(self):
+        """
+        Return all lines currently available, blocking until at least one
+        read has completed. An empty list means end of file.
+        """
+        lines, self.pending = self.pending, []
+        while not lines and not self.eof:
+            lines = self.read_chunk()
+        return lines
+
+    def readline(self):
+        """
+        File-like compatibility: return a single line, '' at end of file.
+        """
+        while not self.pending and not self.eof:
+            self.pending = self.read_chunk()
+        if self.pending:
+            return self.pending.pop(0)
+        return ''
+
+    def detach(self):
+        """
+        Return all buffered but unconsumed data, and reset the buffers.
+        """
+        data = ''.join(self.pending) + self.buffer
+        self.pending, self.buffer = [], ''
+        return data
+
+    def close(self):
+        self.source.close()
+
+
+class FrameReader(object):
+    """
+    Read length-prefixed frames (a 4 byte big-endian length, then that many
+    bytes of payload), with the same interface as LineReader, so it can be
+    used with LinePoller. Empty frames are skipped, so readline() can still
+    use '' to mean end of file.
+
+    The source may be a LineReader (whose source and buffered data we take
+    over), a socket, or a file object, which is then read with exact-sized
+    reads so no data gets stuck in its buffer.
+    """
+    HEADER = struct.Struct('>I')
+    CHUNK_SIZE = 64 * 1024
+    MAX_FRAME = 16 * 1024 * 1024
+
+    def __init__(self, source):
+        self.previous = None
+        self.chunks = []
+        self.have = 0
+        self.need = self.HEADER.size
+        self.pending = []
+        self.eof = False
+        data = ''
+        if isinstance(source, LineReader):
+            self.previous, source, data = source, source.source, source.detach()
+        self.source = source
+        if hasattr(source, 'recv'):
+            self._read, self.exact = source.recv, False
+        elif self.previous is not None:
+            fileno = source.fileno()
+            self._read, self.exact = (lambda c: os.read(fileno, c)), False
+        else:
+            self._read, self.exact = source.read, True
+        if data:
+            self.pending = self.feed(data)
+
+    def fileno(self):
+        return self.source.fileno()
+
+    def feed(self, data):
+        """
+        Add data to our buffer, returning a list of all complete frames.
+        Feeding an empty string signals end of file; a trailing partial
+        frame is discarded.
+        """
+        if not data:
+            self.eof = True
+            self.chunks, self.have = [], 0
+            return []
+
+        self.chunks.append(data)
+        self.have += len(data)
+        if self.have < self.need:
+            return []
+
+        # Join the chunks once we have at least one complete frame, so
+        # each frame is only copied once more, when sliced out.
+        buf = ''.join(self.chunks) if len(self.chunks) > 1 else data
+        frames = []
+        offset = 0
+        while len(buf) - offset >= self.HEADER.size:
+            length, = self.HEADER.unpack_from(buf, offset)
+            if length > self.MAX_FRAME:
+                raise IOError('Frame too large: %d bytes' % length)
+            end = offset + self.HEADER.size + length
+            if end > len(buf):
+                self.need = end - offset
+                break
+            if length:
+                frames.append(buf[offset + self.HEADER.size:end])
+            offset = end
+        else:
+            self.need = self.HEADER.size
+        rest = buf[offset:]
+        self.chunks, self.have = ([rest] if rest else []), len(rest)
+        return frames
+
+    def unread(self, data):
+        """
+        Put data back in front of everything we have buffered. This is for
+        data which arrived before the switch to framing, but was already
+        split into lines.
+        """
+        buffered = ''.join([self.HEADER.pack(len(f)) + f for f in self.pending]
+                           + self.chunks)
+        self.pending, self.chunks, self.have = [], [], 0
+        self.need = self.HEADER.size
+        self.pending = self.feed(data + buffered)
+
+    def read_chunk(self):
+        """
+        Perform a single read and return the resulting complete frames.
+        This will block if the source is not ready.
+        """
+        while True:
+            try:
+                if self.exact:
+                    return self.feed(self._read(self.need - self.have))
+                return self.feed(self._read(self.CHUNK_SIZE))
+            except (IOError, OSError) as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno in (errno.ECONNRESET, errno.EPIPE):
+                    return self.feed('')
+                raise
+
+    def read_lines(self):
+        """
+        Return all frames currently available, blocking until at least one
+        read has completed. An empty list means end of file.
+        """
+        frames, self.pending = self.pending, []
+        while not frames and not self.eof:
+            frames = self.read_chunk()
+        return frames
+
+    def readline(self):
+        """
+        Return a single frame, '' at end of file.
+        """
+        while not self.pending and not self.eof:
+            self.pending = self.read_chunk()
+        if self.pending:
+            return self.pending.pop(0)
+        return ''
+
+    def close(self):
+        self.source.close()
+
+
+class LinePoller(object):
+    """
+    Wait for any number of LineReaders to become readable and drain them.
+    Each call to poll() returns a list of (reader, lines) batches; readers
+    which reach end of file have their eof flag set and are unregistered.
+    """
+    MAX_BATCH_BYTES = 1024 * 1024
+
+    def __init__(self, *readers):
+        self.readers = {}
+        for reader in readers:
+            self.register(reader)
+
+    def register(self, reader):
+        self.readers[reader.fileno()] = reader
+
+    def unregister(self, reader):
+        self.readers.pop(reader.fileno(), None)
+
+    def _ready(self, timeout):
+        fds = list(self.readers.keys())
+        while True:
+            try:
+                if hasattr(select, 'poll'):
+                    poller = select.poll()
+                    for fd in fds:
+                        poller.register(fd, select.POLLIN | select.POLLPRI)
+                    return [fd for fd, ev in poller.poll(
+                        None if timeout is None else int(timeout * 1000))]
+                else:
+                    return select.select(fds, [], [], timeout)[0]
+            except (IOError, OSError, select.error) as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+
+    def poll(self, timeout=None):
+        """
+        Wait up to timeout seconds (forever if None) for data, then read
+        everything which is available without blocking.
+        """
+        batches = {}
+        for fd, reader in self.readers.items():
+            if reader.pending:
+                batches[fd] = (reader, reader.read_lines())
+
+        nbytes = 0
+        ready = self._ready(0 if batches else timeout)
+        while ready:
+            for fd in ready:
+                reader = self.readers[fd]
+                lines = reader.read_chunk()
+                batches.setdefault(fd, (reader, []))[1].extend(lines)
+                nbytes += sum(len(l) for l in lines)
+                if reader.eof:
+                    self.unregister(reader)
+            if nbytes >= self.MAX_BATCH_BYTES or not self.readers:
+                break
+            ready = self._ready(0)
+
+        return list(batches.values())
@@ -0,0 +1,178 @@
+import mmap
+import os
+import struct
+from collections import OrderedDict
+
+# A shared-memory side channel for high-rate updates (OK LISTEN SHM).
+#
+# The app (using ShmWriter) appends fixed-format records to a ring buffer
+# in a memory-mapped file, and the GUI-o-Matic (using ShmReader) samples it
+# a few dozen times per second, applying only the latest value of each
+# field. Writing an update is a memory copy: no syscalls, no JSON.
+#
+# File layout (all little-endian):
+#
+#   header:  magic (8 bytes), record size (uint32), slot count (uint32),
+#            number of records written so far (uint64), padded to 64 bytes
+#   slots:   slot count * record size bytes, record N (counting from 1)
+#            living in slot (N - 1) % slot count
+#
+#   record:  sequence number N (uint64), field (uint16), payload length
+#            (uint16), payload
+#
+# The writer zeroes a record's sequence number while rewriting it, and bumps
+# the header count only once the record is complete. The reader discards
+# records whose sequence number is not what it expects, before or after
+# copying, so records overwritten while being read are never used.
+
+MAGIC = 'GOMSHM1\0'
+HEADER = struct.Struct('<8sIIQ')
+HEADER_SIZE = 64
+WRITTEN_OFFSET = 16
+RECORD = struct.Struct('<QHH')
+SEQUENCE = struct.Struct('<Q')
+RECORD_SIZE = 256
+PAYLOAD_MAX = RECORD_SIZE - RECORD.size
+
+PROGRESS = 1  # Payload: a double, from 0 to 1
+MESSAGE = 2   # Payload: UTF-8 text
+STATUS = 3    # Payload: UTF-8 status name
+DISPLAY = 4   # Payload: UTF-8 status display id, NUL, details
+
+PROGRESS_VALUE = struct.Struct('<d')
+
+
+def decode(field, payload):
+    """
+    Convert a record to (key, command, arguments). Only the latest record
+    for each key matters.
+    """
+    if field == PROGRESS:
+        value, = PROGRESS_VALUE.unpack(payload)
+        return (field,), 'update_splash_screen', {'progress': value}
+    elif field == MESSAGE:
+        return ((field,), 'update_splash_screen',
+                {'message': payload.decode('utf-8')})
+    elif field == STATUS:
+        return (field,), 'set_status', {'status': payload.decode('utf-8')}
+    elif field == DISPLAY:
+        id, details = payload.decode('utf-8').split(u'\0', 1)
+        return (field, id), 'set_status_display', {
+            'id': id, 'details': details}
+    raise ValueError('Unknown shared memory field: %s' % field)
+
+
+class ShmWriter(object):
+    """
+    Create a shared memory update channel and write updates to it. This
+    is meant for apps driving the GUI-o-Matic, not the GUI itself.
+    """
+    def __init__(self, path, slots=1024):
+        self.path = path
+        self.slots = slots
+        self.written = 0
+        size = HEADER_SIZE + slots * RECORD_SIZE
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0600)
+        try:
+            os.write(fd, '\0' * size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        HEADER.pack_into(self.map, 0, MAGIC, RECORD_SIZE, slots, 0)
+
+    def write(self, field, payload):
+        if len(payload) > PAYLOAD_MAX:
+            raise ValueError('Payload too long: %d > %d bytes'
+                             % (len(payload), PAYLOAD_MAX))
+        seq = self.written + 1
+        offset = HEADER_SIZE + ((seq - 1) % self.slots) * RECORD_SIZE
+        RECORD.pack_into(self.map, offset, 0, field, len(payload))
+        start = offset + RECORD.size
+        self.map[start:start + len(payload)] = payload
+        SEQUENCE.pack_into(self.map, offset, seq)
+        SEQUENCE.pack_into(self.map, WRITTEN_OFFSET, seq)
+        self.written = seq
+
+    def progress(self, progress):
+        self.write(PROGRESS, PROGRESS_VALUE.pack(progress))
+
+    def message(self, message):
+        self.write(MESSAGE, message.encode('utf-8'))
+
+    def status(self, status):
+        self.write(STATUS, status.encode('utf-8'))
+
+    def display(self, id, details):
+        self.write(DISPLAY, (u'%s\0%s' % (id, details)).encode('utf-8'))
+
+    def close(self):
+        self.map.close()
+
+
+class ShmReader(object):
+    """
+    Read updates from a shared memory channel created by ShmWriter.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as fd:
+            self.map = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER_SIZE:
+            raise ValueError('Not a shared memory channel: %s' % path)
+        magic, self.record_size, self.slots, written = (
+            HEADER.unpack_from(self.map, 0))
+        if (magic != MAGIC or self.record_size < RECORD.size or
+                len(self.map) < HEADER_SIZE + self.slots * self.record_size):
+            raise ValueError('Not a shared memory channel: %s' % path)
+        # Replay whatever is still in the buffer, so values written before
+        # we attached (e.g. the current status) are not lost.
+        self.read = max(0, written - self.slots)
+        self.sampled = 0
+        self.dropped = 0
+        self.torn = 0
+        self.invalid = 0
+
+    def stats(self):
+        return {
+            'sampled': self.sampled,
+            'dropped': self.dropped,
+            'torn': self.torn,
+            'invalid': self.invalid}
+
+    def sample(self):
+        """
+        Return a list of (command, arguments) pairs for the latest value
+        of each field written since the last call.
+        """
+        written, = SEQUENCE.unpack_from(self.map, WRITTEN_OFFSET)
+        if written < self.read:
+            self.read = 0  # The writer started over
+        if written == self.read:
+            return []
+
+        first = max(self.read + 1, written - self.slots + 1)
+        self.dropped += first - (self.read + 1)
+        latest = OrderedDict()
+        for seq in xrange(first, written + 1):
+            offset = HEADER_SIZE + ((seq - 1) % self.slots) * self.record_size
+            before, field, length = RECORD.unpack_from(self.map, offset)
+            start = offset + RECORD.size
+            length = min(length, self.record_size - RECORD.size)
+            payload = self.map[start:start + length]
+            after, = SEQUENCE.unpack_from(self.map, offset)
+            if not before == after == seq:
+                self.torn += 1
+                continue
+            try:
+                key, command, args = decode(field, payload)
+            except (ValueError, struct.error, UnicodeDecodeError):
+                self.invalid += 1
+                continue
+            latest.pop(key, None)
+            latest[key] = (command, args)
+
+        self.read = written
+        self.sampled += written - first + 1
+        return latest.values()
+
+    def close(self):
+        self.map.close()
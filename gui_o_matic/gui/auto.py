@@ -1,5 +1,12 @@
 import copy
 import importlib
+import os
+import sys
+import threading
+import time
+
+from gui_o_matic import startup
+from gui_o_matic.cachedir import cache_path
 
 # Note: This is NOT dict, because order matters.
 #       Some GUIs are better than others, and we want to try them first.
@@ -9,8 +16,31 @@ _registry = (
     ('macosx',  'macosx'),
     ('unity',   'unity'),
     ('gtk',     'gtkbase'),
+    ('headless', 'headless'),
 )
 
+# GUIs which are never chosen automatically, only via _prefer_gui. The
+# headless GUI shows nothing, so falling back to it would hide failures.
+_manual = set(['headless'])
+
+# GUIs whose toolkit (pygtk) must be imported and set up on the main thread
+_main_thread_only = set(['unity', 'gtk'])
+
+# GUIs which only make sense on one platform (a sys.platform prefix).
+# These are skipped elsewhere, instead of paying for a failed import.
+_platforms = {
+    'winapi': 'win32',
+    'macosx': 'darwin',
+}
+
+# The last GUI which worked is remembered here, and tried first next time.
+# The hint expires, so newly installed (better) GUIs get noticed.
+HINT_FILE = 'last-gui'
+HINT_MAX_AGE = 7 * 24 * 3600
+
+# GUIs which preload() found could not be imported
+_unavailable = set()
+
 
 def _known_guis():
     '''
@@ -19,6 +49,15 @@ def _known_guis():
     return [gui for gui, lib in _registry]
 
 
+def _platform_guis():
+    '''
+    List known guis which might work on this platform, best first.
+    '''
+    return [gui for gui in _known_guis()
+            if gui not in _manual and
+            sys.platform.startswith(_platforms.get(gui, ''))]
+
+
 def _gui_libname(gui):
     '''
     Convert a gui-name to a libname, assume well-formed if not in registry
@@ -29,16 +68,81 @@ def _gui_libname(gui):
         return gui
 
 
+def _read_hint():
+    try:
+        path = cache_path(HINT_FILE)
+        if time.time() - os.path.getmtime(path) < HINT_MAX_AGE:
+            with open(path, 'r') as fd:
+                return fd.read().strip()
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def _write_hint(gui):
+    try:
+        with open(cache_path(HINT_FILE), 'w') as fd:
+            fd.write(gui + '\n')
+    except (IOError, OSError):
+        pass
+
+
+def _candidates(config):
+    """
+    Return the GUIs to try, best first, and the hint (if it was used).
+    """
+    candidates = config.get('_prefer_gui')
+    hint = None
+    if not candidates:
+        candidates = _platform_guis()
+        hint = _read_hint()
+        if hint in candidates:
+            candidates.remove(hint)
+            candidates.insert(0, hint)
+    return candidates, hint
+
+
+def preload():
+    """
+    Import the GUI we expect to use on a background thread, so the work
+    overlaps with reading the config. Toolkits which must be imported on
+    the main thread are left alone; we only import our shared code then.
+    """
+    def load():
+        for candidate in _candidates({})[0]:
+            if candidate in _main_thread_only:
+                libname = 'gui_o_matic.gui.base'
+            else:
+                libname = _gui_libname(candidate)
+            try:
+                with startup.timed('preload GUI: %s' % candidate):
+                    importlib.import_module(libname)
+                return
+            except Exception:
+                _unavailable.add(candidate)
+
+    loader = threading.Thread(target=load, name='preload')
+    loader.daemon = True
+    loader.start()
+    return loader
+
+
 def AutoGUI(config, *args, **kwargs):
     """
     Load and instanciate the best GUI available for this machine.
     """
-    for candidate in config.get('_prefer_gui', _known_guis()):
+    candidates, hint = _candidates(config)
+    for candidate in candidates:
+        if candidate in _unavailable:
+            continue
         try:
-            impl = importlib.import_module(_gui_libname(candidate))
-            return impl.GUI( config, *args, **kwargs )
+            with startup.timed('load GUI: %s' % candidate):
+                impl = importlib.import_module(_gui_libname(candidate))
+                gui = impl.GUI( config, *args, **kwargs )
         except ImportError:
-            pass
+            continue
+        if candidate != hint and not config.get('_prefer_gui'):
+            _write_hint(candidate)
+        return gui
 
     raise NotImplementedError("No working GUI found!")
-
@@ -1,12 +1,19 @@
 import copy
 import json
-import os
 import subprocess
 import threading
 import traceback
 import urllib
 import webbrowser
 
+from gui_o_matic import startup
+from gui_o_matic.config import compile_config
+from gui_o_matic.gui.diskcache import DiskCache
+from gui_o_matic.gui.httpclient import HTTPClient
+from gui_o_matic.gui.imagecache import ImageCache
+from gui_o_matic.gui.reaper import ChildReaper
+from gui_o_matic.gui.shellpool import ShellPool, last_line
+
 
 class BaseGUI(object):
     """
@@ -16,11 +23,63 @@ class BaseGUI(object):
 
     ICON_THEME = 'light'
 
+    # Upper bound on memory used by decoded images in the image cache
+    IMAGE_CACHE_BYTES = 32 * 1024 * 1024
+
+    # Size limit of the on-disk cache of converted images. It is off (0)
+    # unless the config asks for it, as it writes to the user's disk.
+    DISK_CACHE_BYTES = 0
+
+    # Concurrency and timeout (seconds) for get_url/post_url actions
+    HTTP_WORKERS = 4
+    HTTP_TIMEOUT = 30
+
+    # Concurrency and per-command timeout (seconds) for shell actions
+    SHELL_WORKERS = 2
+    SHELL_TIMEOUT = 300
+
     def __init__(self, config):
         self.config = config
+        self._config = compile_config(config, self.ICON_THEME)
+        for warning in self._config.warnings:
+            print('Warning: %s' % warning)
+        self._image_cache = ImageCache(self.IMAGE_CACHE_BYTES)
+        disk_cache_bytes = config.get('disk_cache_bytes',
+                                      self.DISK_CACHE_BYTES)
+        self._disk_cache = (DiskCache(disk_cache_bytes)
+                            if disk_cache_bytes else None)
+        self._http = None
+        self._shell = None
+        self._reaper = ChildReaper(
+            on_error=lambda e: self._idle(self._report_error, e))
+        self._ready_event = threading.Event()
         self.ready = False
         self.next_error_message = None
 
+    def _get_ready(self):
+        return self._ready_event.is_set()
+
+    def _set_ready(self, ready):
+        if ready:
+            self._ready_event.set()
+            startup.report()
+        else:
+            self._ready_event.clear()
+
+    # Backends just set self.ready = True when their main loop is up; the
+    # event lets the control thread block on that instead of polling.
+    ready = property(_get_ready, _set_ready)
+
+    def _wait_until_ready(self, timeout=None):
+        return self._ready_event.wait(timeout)
+
+    def _idle(self, callback, *args):
+        """
+        Run callback(*args) on the GUI thread, during the next iteration of
+        the main loop. We have no main loop, so just call it right away.
+        """
+        callback(*args)
+
     def _get_url(self, args, remove=False):
         if isinstance(args, list):
             if remove:
@@ -46,33 +105,10 @@ class BaseGUI(object):
 
             elif op in ('get_url', 'post_url'):
                 url, args = self._get_url(args, remove=True)
-                base_url = '/'.join(url.split('/')[:3])
-
-                uo = urllib.URLopener()
-                for cookie, value in self.config.get('http_cookies', {}
-                                                     ).get(base_url, []):
-                    uo.addheader('Cookie', '%s=%s' % (cookie, value))
-
-                if op == 'post_url':
-                    (fn, hdrs) = uo.retrieve(url, data=args)
-                else:
-                    (fn, hdrs) = uo.retrieve(url)
-                hdrs = unicode(hdrs)
-
-                with open(fn, 'rb') as fd:
-                    data = fd.read().strip()
-
-                if data.startswith('{') and 'application/json' in hdrs:
-                    data = json.loads(data)
-                    if 'message' in data:
-                        self.notify_user(data['message'])
+                self._http_request(op, url, args)
 
             elif op == "shell":
-                for arg in args:
-                    rv = os.system(arg)
-                    if 0 != rv:
-                        raise OSError(
-                            'Failed with exit code %d: %s' % (rv, arg))
+                self._shell_commands(args)
 
             elif hasattr(self, op):
                 getattr(self, op)(**(args or {}))
@@ -80,20 +116,71 @@ class BaseGUI(object):
         except Exception, e:
             self._report_error(e)
 
+    def _http_request(self, op, url, args):
+        """
+        Send an HTTP request in the background. If the response is a JSON
+        dictionary with a message, it is shown using notify_user.
+        """
+        base_url = '/'.join(url.split('/')[:3])
+        all_cookies = self.config.get('http_cookies', {})
+        cookies = (all_cookies.get(base_url) or
+                   all_cookies.get(base_url.split('/')[-1]) or {})
+
+        headers = {}
+        if cookies:
+            headers['Cookie'] = '; '.join(
+                '%s=%s' % (k, v) for k, v in cookies.iteritems())
+        if op == 'post_url':
+            method = 'POST'
+            if isinstance(args, dict):
+                args = urllib.urlencode(args)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        else:
+            method, args = 'GET', None
+
+        def done(status, hdrs, data):
+            if not 200 <= status < 300:
+                raise IOError('HTTP error %d: %s' % (status, url))
+            data = data.strip()
+            if (data.startswith('{') and
+                    'application/json' in (hdrs.getheader('Content-Type')
+                                           or '')):
+                data = json.loads(data)
+                if 'message' in data:
+                    self._idle(self.notify_user, data['message'])
+
+        if self._http is None:
+            self._http = HTTPClient(max_workers=self.HTTP_WORKERS,
+                                    timeout=self.HTTP_TIMEOUT,
+                                    on_error=lambda e: self._idle(
+                                        self._report_error, e))
+        self._http.submit(method, url, args, headers, callback=done)
+
+    def _shell_commands(self, commands):
+        """
+        Run shell commands in the background, in order, stopping at the
+        first failure. On success, the last line of output (if any) is
+        shown using notify_user.
+        """
+        def done(output):
+            if last_line(output):
+                self._idle(self.notify_user, last_line(output))
+
+        if self._shell is None:
+            self._shell = ShellPool(max_workers=self.SHELL_WORKERS,
+                                    timeout=self.config.get(
+                                        'shell_timeout', self.SHELL_TIMEOUT),
+                                    on_error=lambda e: self._idle(
+                                        self._report_error, e))
+        self._shell.submit(list(commands or []), callback=done)
+
     def _spawn(self, cmd, report_errors=True, _raise=False):
-        def waiter(proc):
-            try:
-                rv = proc.wait()
-                if rv:
-                    raise Exception('%s returned: %d' % (cmd[0], rv))
-            except Exception, e:
-                if report_errors:
-                    self._report_error(e)
+        def reaped(proc, rv):
+            if rv and report_errors:
+                raise Exception('%s returned: %d' % (cmd[0], rv))
         try:
             proc = subprocess.Popen(cmd, close_fds=True)
-            st = threading.Thread(target=waiter, args=[proc])
-            st.daemon = True
-            st.start()
+            self._reaper.watch(proc, reaped)
             return True
         except Exception, e:
             if _raise:
@@ -124,15 +211,62 @@ class BaseGUI(object):
         self._spawn(cmd)
 
     def _theme_image(self, path):
-        if path.startswith('image:'):
-            path = self.config['images'][path.split(':', 1)[1]]
-        path = path.replace('%(theme)s', self.ICON_THEME)
-        if path != os.path.abspath(path):
-            # The protocol mandates absolute paths, to avoid weird breakage
-            # if the config and GUI app are generated from different working
-            # directories. Fail here to help developers catch bugs early.
-            raise ValueError('Path is not absolute: %s' % path)
-        return path
+        return self._config.image(path)
+
+    def _cached_image(self, path, size, load, nbytes=None, kind=None):
+        """
+        Fetch a decoded image from the image cache, using load(path, size)
+        to decode (and scale) it on a miss. The path should already have
+        been passed through _theme_image() or equivalent.
+        """
+        return self._image_cache.get(path, size, load, nbytes, kind)
+
+    def _disk_cached(self, path, size, kind, render):
+        """
+        Fetch converted image data (a string in the format named by kind)
+        from the on-disk cache, using render() to create it on a miss.
+        """
+        if self._disk_cache is None:
+            return render()
+        return self._disk_cache.fetch(path, size, kind, render)
+
+    def _image_variants(self):
+        """
+        Return a list of (size, load, nbytes, kind) tuples, describing the
+        variants of each configured image this GUI is likely to need. These
+        get pre-rendered into the image cache by _prerender_images().
+        """
+        return []
+
+    def _image_source(self, path):
+        """Map a configured image path to the file actually loaded."""
+        return self._theme_image(path)
+
+    def _prerender_images(self):
+        """
+        Decode and scale every configured image into all the variants this
+        GUI expects to need, on a background thread. Status changes then
+        only need a cache lookup.
+        """
+        variants = self._image_variants()
+        paths = sorted(set(self._config.images.values()))
+        if not (variants and paths):
+            return None
+
+        def prerender():
+            for path in paths:
+                for size, load, nbytes, kind in variants:
+                    try:
+                        self._cached_image(self._image_source(path),
+                                           size, load, nbytes, kind)
+                    except Exception:
+                        # Errors get reported if the image is actually used
+                        pass
+
+        renderer = threading.Thread(target=prerender, name='prerender')
+        renderer.daemon = True
+        renderer.start()
+        return renderer
 
     def _add_menu_item(self, id='item', label='Menu item', sensitive=False,
                              op=None, args=None, **ignored_kwargs):
@@ -190,5 +324,6 @@ class BaseGUI(object):
                 % {'error': unicode(e)})
 
     def notify_user(self,
-            message='Hello', popup=False, alert=False, actions=None):
+            message='Hello', popup=False, alert=False, actions=None,
+            category=None):
         print('NOTIFY: %s' % message)
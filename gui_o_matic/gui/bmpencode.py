@@ -0,0 +1,95 @@
+import struct
+
+# Fast BMP and ICO encoders for RGBA images.
+#
+# Each file is built in a single preallocated bytearray: the headers are
+# packed in place with struct.pack_into, and the pixels are copied in once,
+# already in Windows' bottom-up BGRA layout, straight from PIL's raw
+# encoder. BMPs are byte-for-byte identical to what pil_bmp_fix writes.
+
+BMP_FILE_HEADER = 14
+BITMAPINFOHEADER = 40
+BITMAPV4HEADER = 108
+ICO_DIR_HEADER = 6
+ICO_DIR_ENTRY = 16
+
+BI_RGB = 0
+BI_BITFIELDS = 3
+LCS_sRGB = 0x73524742
+
+_file_header = struct.Struct('<2sIHHI')
+_info_header = struct.Struct('<IiiHHIIiiII')
+_v4_masks = struct.Struct('<IIIII')
+_ico_dir = struct.Struct('<HHH')
+_ico_entry = struct.Struct('<BBBBHHII')
+
+
+def _pixels(image):
+    """Return the image's pixels as bottom-up BGRA rows."""
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+    return image.tobytes('raw', 'BGRA', image.size[0] * 4, -1)
+
+
+def _ppm(dpi):
+    # 1 meter == 39.3701 inches
+    return int(dpi[0] * 39.3701), int(dpi[1] * 39.3701)
+
+
+def bmp(image, dpi=(96, 96)):
+    """
+    Encode an image as a 32-bit BMP with a BITMAPV4HEADER (so the alpha
+    channel is described), returning a bytearray.
+    """
+    width, height = image.size
+    image_size = width * 4 * height
+    offset = BMP_FILE_HEADER + BITMAPV4HEADER
+    ppm = _ppm(dpi)
+
+    buf = bytearray(offset + image_size)
+    _file_header.pack_into(buf, 0, b'BM', len(buf), 0, 0, offset)
+    _info_header.pack_into(buf, BMP_FILE_HEADER,
+                           BITMAPV4HEADER, width, height, 1, 32,
+                           BI_BITFIELDS, image_size, ppm[0], ppm[1], 0, 0)
+    _v4_masks.pack_into(buf, BMP_FILE_HEADER + BITMAPINFOHEADER,
+                        0x00ff0000, 0x0000ff00, 0x000000ff, 0xff000000,
+                        LCS_sRGB)
+    # The rest of the V4 header (colour space endpoints, gamma) stays zero
+    memoryview(buf)[offset:] = _pixels(image)
+    return buf
+
+
+def ico(images):
+    """
+    Encode one or more images (e.g. the same icon at several sizes, at
+    most 256x256 each) as a multi-resolution ICO file with 32-bit DIB
+    entries, returning a bytearray.
+    """
+    layout = []
+    offset = ICO_DIR_HEADER + ICO_DIR_ENTRY * len(images)
+    for image in images:
+        width, height = image.size
+        if width > 256 or height > 256:
+            raise ValueError('Icons must be at most 256x256')
+        xor_size = width * 4 * height
+        and_size = ((width + 31) // 32) * 4 * height
+        size = BITMAPINFOHEADER + xor_size + and_size
+        layout.append((image, offset, size, xor_size + and_size))
+        offset += size
+
+    buf = bytearray(offset)
+    view = memoryview(buf)
+    _ico_dir.pack_into(buf, 0, 0, 1, len(images))
+    for i, (image, offset, size, image_size) in enumerate(layout):
+        width, height = image.size
+        _ico_entry.pack_into(buf, ICO_DIR_HEADER + i * ICO_DIR_ENTRY,
+                             width & 255, height & 255, 0, 0, 1, 32,
+                             size, offset)
+        # ICO entries have double height: the colour bitmap, then the AND
+        # mask. The mask is left all zero, as the alpha channel is used.
+        _info_header.pack_into(buf, offset,
+                               BITMAPINFOHEADER, width, height * 2, 1, 32,
+                               BI_RGB, image_size, 0, 0, 0, 0)
+        start = offset + BITMAPINFOHEADER
+        view[start:start + width * 4 * height] = _pixels(image)
+    return buf
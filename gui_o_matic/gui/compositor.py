@@ -0,0 +1,209 @@
+# Alpha-blending compositor for the winapi GUI. This only depends on PIL,
+# so it can be tested and benchmarked on any platform.
+#
+import PIL.Image
+
+
+def rect_intersect( rect_a, rect_b ):
+    x_min = max(rect_a[0], rect_b[0])
+    y_min = max(rect_a[1], rect_b[1])
+    x_max = min(rect_a[2], rect_b[2])
+    y_max = min(rect_a[3], rect_b[3])
+    return (x_min, y_min, x_max, y_max)
+
+def rect_union( rect_a, rect_b ):
+    return (min(rect_a[0], rect_b[0]),
+            min(rect_a[1], rect_b[1]),
+            max(rect_a[2], rect_b[2]),
+            max(rect_a[3], rect_b[3]))
+
+def rect_empty( rect ):
+    return rect[2] <= rect[0] or rect[3] <= rect[1]
+
+def rect_area( rect ):
+    return 0 if rect_empty( rect ) else (rect[2] - rect[0]) * (rect[3] - rect[1])
+
+def merge_rects( rects ):
+    '''
+    Merge overlapping rectangles into their bounding boxes, so no pixel
+    gets composited twice.
+    '''
+    merged = []
+    for rect in rects:
+        while True:
+            for i, other in enumerate( merged ):
+                if not rect_empty( rect_intersect( rect, other ) ):
+                    rect = rect_union( rect, merged.pop( i ) )
+                    break
+            else:
+                break
+        merged.append( rect )
+    return merged
+
+
+class Compositor( object ):
+    '''
+    Alpha-blend compatability class.
+
+    Since we're having trouble getting alpha into winapi objects, blend images
+    in python, then move them out to winapi as RGB.
+
+    The compositor keeps the last rendered image. Operations report the
+    regions they change (damage) as their image or rect is modified, and
+    composite() then re-composites only those regions.
+    '''
+
+    # If more than this fraction of the image is damaged, just redraw it all
+    FULL_REDRAW_RATIO = 0.6
+
+    class Operation( object ):
+        '''
+        Applies an effect to an image
+        '''
+        compositor = None
+
+        def __init__( self, rect = None ):
+            self._rect = rect
+
+        def damage( self, rect = None ):
+            if self.compositor is not None:
+                self.compositor.damage( rect or self._rect )
+
+        def _get_rect( self ):
+            return self._rect
+
+        def _set_rect( self, rect ):
+            if rect != self._rect:
+                self.damage()
+                self._rect = rect
+                self.damage()
+
+        rect = property( _get_rect, _set_rect )
+
+        def target( self, canvas ):
+            '''
+            Return the region of the canvas this operation draws on
+            '''
+            return self._rect or (0, 0, canvas[0], canvas[1])
+
+    class Fill( Operation ):
+        '''
+        Stretches the target region with the specified color.
+        '''
+
+        def __init__( self, color, rect = None ):
+            super(Compositor.Fill, self).__init__( rect )
+            self.color = color
+
+        def __call__( self, image, origin = (0, 0), canvas = None ):
+            rect = self.target( canvas or image.size )
+            rect = rect_intersect( (rect[0] - origin[0],
+                                    rect[1] - origin[1],
+                                    rect[2] - origin[0],
+                                    rect[3] - origin[1]),
+                                   (0, 0, image.width, image.height) )
+            if not rect_empty( rect ):
+                image.paste( self.color, rect )
+
+    class Blend( Operation ):
+
+        def __init__( self, source, rect = None ):
+            super(Compositor.Blend, self).__init__( rect )
+            self.set_image( source )
+
+        def set_image( self, source ):
+            self._source = source if source.mode == "RGBA" else source.convert("RGBA")
+            self._scaled = None
+            self.damage()
+
+        source = property( lambda self: self._source, set_image )
+
+        def scaled( self, size ):
+            '''
+            Return the source scaled to size, reusing the last result
+            '''
+            if size == self._source.size:
+                return self._source
+            if self._scaled is None or self._scaled.size != size:
+                self._scaled = self._source.resize( size, PIL.Image.ANTIALIAS )
+            return self._scaled
+
+        def __call__( self, image, origin = (0, 0), canvas = None ):
+            rect = self.target( canvas or image.size )
+            if rect_empty( rect ):
+                return
+            clip = rect_intersect( rect, (origin[0],
+                                          origin[1],
+                                          origin[0] + image.width,
+                                          origin[1] + image.height) )
+            if rect_empty( clip ):
+                return
+            scaled = self.scaled( (rect[2] - rect[0], rect[3] - rect[1]) )
+            image.alpha_composite( scaled,
+                                   dest = (clip[0] - origin[0],
+                                           clip[1] - origin[1]),
+                                   source = (clip[0] - rect[0],
+                                             clip[1] - rect[1],
+                                             clip[2] - rect[0],
+                                             clip[3] - rect[1]) )
+
+    def __init__( self ):
+        self.operations = []
+        self.image = None
+        self.image_background = None
+        self.damaged = None
+
+    def add( self, operation ):
+        operation.compositor = self
+        self.operations.append( operation )
+        operation.damage()
+
+    def damage( self, rect = None ):
+        '''
+        Mark a region (or everything, if rect is None) for re-compositing.
+        '''
+        if rect is None:
+            self.damaged = None
+        elif self.damaged is not None:
+            self.damaged.append( rect )
+
+    def invalidate( self ):
+        self.damage( None )
+
+    def render( self, size, background = (0,0,0,0) ):
+        image = PIL.Image.new( "RGBA", size, background )
+        for operation in self.operations:
+            operation( image )
+        return image
+
+    def composite( self, size, background = (0,0,0,0) ):
+        '''
+        Bring self.image up to date, and return the list of regions which
+        changed (empty if none did).
+        '''
+        canvas = (0, 0, size[0], size[1])
+        full = (self.image is None or
+                self.damaged is None or
+                self.image.size != size or
+                self.image_background != background)
+        if not full:
+            rects = merge_rects( [ r for r in (rect_intersect( d, canvas )
+                                               for d in self.damaged)
+                                   if not rect_empty( r ) ] )
+            full = (sum( map( rect_area, rects ) ) >
+                    self.FULL_REDRAW_RATIO * rect_area( canvas ))
+        self.damaged = []
+
+        if full:
+            self.image = self.render( size, background )
+            self.image_background = background
+            return [ canvas ]
+
+        for rect in rects:
+            patch = PIL.Image.new( "RGBA",
+                                   (rect[2] - rect[0], rect[3] - rect[1]),
+                                   background )
+            for operation in self.operations:
+                operation( patch, origin = rect[:2], canvas = size )
+            self.image.paste( patch, rect[:2] )
+        return rects
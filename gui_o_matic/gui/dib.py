@@ -0,0 +1,63 @@
+import struct
+
+# Parsing of in-memory BMP and ICO data (see bmpencode), for the winapi GUI
+# to turn into bitmap and icon handles without going via temporary files.
+# Nothing here depends on Windows, so it can be tested anywhere.
+
+BMP_FILE_HEADER = 14
+ICO_DIR_HEADER = 6
+ICO_DIR_ENTRY = 16
+
+
+def bmp_layout(data):
+    """
+    Return (info, bits) for BMP file data: the BITMAPINFO structure (header
+    plus any masks or palette) and the offset of the pixel data.
+    """
+    if data[:2] != b'BM' or len(data) < BMP_FILE_HEADER + 4:
+        raise ValueError('Not BMP data')
+    bits, = struct.unpack_from('<I', data, 10)
+    if not BMP_FILE_HEADER < bits <= len(data):
+        raise ValueError('Bad BMP pixel data offset: %d' % bits)
+    return data[BMP_FILE_HEADER:bits], bits
+
+
+def bmp_size(data):
+    """Return the (width, height) of BMP file data."""
+    info, bits = bmp_layout(data)
+    width, height = struct.unpack_from('<ii', data, BMP_FILE_HEADER + 4)
+    return width, abs(height)
+
+
+def ico_entries(data):
+    """
+    Return a list of (width, height, bits per pixel, resource data) for
+    each image in ICO file data. The resource data is what Windows expects
+    for CreateIconFromResourceEx (a DIB or a PNG).
+    """
+    reserved, kind, count = struct.unpack_from('<HHH', data, 0)
+    if reserved != 0 or kind != 1:
+        raise ValueError('Not ICO data')
+    entries = []
+    for i in range(0, count):
+        (width, height, colors, reserved, planes, bpp, size, offset
+         ) = struct.unpack_from('<BBBBHHII', data,
+                                ICO_DIR_HEADER + i * ICO_DIR_ENTRY)
+        if offset + size > len(data):
+            raise ValueError('Truncated ICO data')
+        entries.append((width or 256, height or 256, bpp,
+                        data[offset:offset + size]))
+    return entries
+
+
+def ico_best_entry(data, size):
+    """
+    Choose the entry closest to the requested (width, height). Ties go to
+    larger images (which scale down nicely), then to more colors.
+    """
+    def score(entry):
+        width, height, bpp, ignored = entry
+        return (abs(width - size[0]) + abs(height - size[1]),
+                width < size[0],
+                -bpp)
+    return min(ico_entries(data), key=score)
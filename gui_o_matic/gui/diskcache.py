@@ -0,0 +1,116 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+from gui_o_matic import cachedir
+
+
+class DiskCache(object):
+    """
+    A size-bounded on-disk cache of converted images, so a restarted GUI
+    need not decode and scale the same images again.
+
+    Entries are content-addressed: the file name is a hash of the source
+    path, its modification time and size, the target size and the format
+    of the stored data, so editing a source image simply stops its old
+    entries from being used. Once the cache grows beyond max_bytes, the
+    least recently used entries are deleted.
+
+    The cache is best-effort: any I/O error is treated as a miss.
+    """
+    def __init__(self, max_bytes, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.bytes = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        return {
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions}
+
+    def _path(self, name):
+        if self.directory is None:
+            return cachedir.cache_path('images', name)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, 0700)
+        return os.path.join(self.directory, name)
+
+    def key(self, path, size, kind):
+        """Return the cache file name for a variant of path."""
+        st = os.stat(path)
+        digest = hashlib.sha1(repr((
+            os.path.abspath(path), st.st_mtime, st.st_size, size, kind)))
+        return '%s.%s' % (digest.hexdigest(), kind)
+
+    def get(self, path, size, kind):
+        """Return the cached data for a variant of path, or None."""
+        try:
+            entry = self._path(self.key(path, size, kind))
+            with open(entry, 'rb') as fd:
+                data = fd.read()
+            os.utime(entry, None)  # Mark as recently used
+            self.hits += 1
+            return data
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+
+    def put(self, path, size, kind, data):
+        """Store data for a variant of path, evicting old entries."""
+        try:
+            entry = self._path(self.key(path, size, kind))
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(entry),
+                                       suffix='.tmp')
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+            if os.name == 'nt' and os.path.exists(entry):
+                os.remove(entry)
+            os.rename(tmp, entry)
+        except (IOError, OSError):
+            return
+        with self.lock:
+            if self.bytes is not None:
+                self.bytes += len(data)
+            if self.bytes is None or self.bytes > self.max_bytes:
+                self._evict(os.path.dirname(entry))
+
+    def fetch(self, path, size, kind, render):
+        """
+        Return the cached data for a variant of path, calling render() to
+        create (and store) it on a miss.
+        """
+        data = self.get(path, size, kind)
+        if data is None:
+            data = render()
+            self.put(path, size, kind, data)
+        return data
+
+    def _evict(self, directory):
+        entries = []
+        total = 0
+        for name in os.listdir(directory):
+            try:
+                st = os.stat(os.path.join(directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+        entries.sort()
+        while total > self.max_bytes and entries:
+            mtime, size, name = entries.pop(0)
+            try:
+                os.remove(os.path.join(directory, name))
+                total -= size
+                self.evictions += 1
+            except OSError:
+                pass
+        self.bytes = total
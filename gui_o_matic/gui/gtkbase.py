@@ -1,30 +1,38 @@
 import pango
 import gobject
 import gtk
+import struct
 import threading
 import traceback
-try:
-    import pynotify
-except ImportError:
-    pynotify = None
 
+from gui_o_matic import startup
 from gui_o_matic.gui.base import BaseGUI
+from gui_o_matic.gui.notify import NotificationManager, best_backend
 
 
 class GtkBaseGUI(BaseGUI):
 
     _HAVE_INDICATOR = False
 
+    # Show at most this many popups per period (seconds); more get merged.
+    # The config can override these with notify_budget and notify_period.
+    NOTIFY_BUDGET = 3
+    NOTIFY_PERIOD = 5.0
+
     def __init__(self, config):
         BaseGUI.__init__(self, config)
         self.splash = None
         self.font_styles = {}
         self.status_display = {}
-        self.popup = None
-        if pynotify:
-            pynotify.init(config.get('app_name', 'gui-o-matic'))
+        self._notifier = None
         gobject.threads_init()
 
+    def _idle(self, callback, *args):
+        def run_once():
+            callback(*args)
+            return False
+        gobject.idle_add(run_once)
+
     def _menu_setup(self):
         self.items = {}
         self.menu = gtk.Menu()
@@ -49,16 +57,76 @@ class GtkBaseGUI(BaseGUI):
         if id:
             self.items[id] = menu_item
 
+    # Scaled pixbufs are stored in the disk cache as this header (width,
+    # height, rowstride, has_alpha) followed by the raw pixel data.
+    _PIXBUF_HEADER = struct.Struct('<IIIB')
+
+    def _pixbuf_load(self, path, size):
+        if not size:
+            return gtk.gdk.pixbuf_new_from_file(path)
+
+        def render():
+            pixbuf = gtk.gdk.pixbuf_new_from_file(path).scale_simple(
+                size[0], size[1], gtk.gdk.INTERP_BILINEAR)
+            return self._PIXBUF_HEADER.pack(
+                pixbuf.get_width(), pixbuf.get_height(),
+                pixbuf.get_rowstride(), pixbuf.get_has_alpha()
+                ) + pixbuf.get_pixels()
+
+        data = self._disk_cached(path, size, 'gdk-pixbuf', render)
+        width, height, rowstride, has_alpha = (
+            self._PIXBUF_HEADER.unpack_from(data))
+        return gtk.gdk.pixbuf_new_from_data(
+            data[self._PIXBUF_HEADER.size:], gtk.gdk.COLORSPACE_RGB,
+            bool(has_alpha), 8, width, height, rowstride)
+
+    @staticmethod
+    def _pixbuf_bytes(pixbuf):
+        return pixbuf.get_rowstride() * pixbuf.get_height()
+
+    def _load_pixbuf(self, image, size=None):
+        return self._cached_image(self._theme_image(image), size,
+                                  self._pixbuf_load, self._pixbuf_bytes)
+
+    def _status_icon_size(self):
+        # Scale the status icons relative to a) how tall the window is,
+        # and b) how many status lines we are showing.
+        wcfg = self.config['main_window']
+        return int(0.66 * wcfg.get('height', 360) /
+                   max(1, len(self._config.status_displays)))
+
+    def _image_variants(self):
+        sizes = [(32, 32)]  # Indicator icon
+        if self.config.get('main_window'):
+            icon_size = self._status_icon_size()
+            sizes.append((icon_size, icon_size))
+        return [(size, self._pixbuf_load, self._pixbuf_bytes, None)
+                for size in sizes]
+
     def _set_background_image(self, container, image):
-        themed_image = self._theme_image(image)
-        img = gtk.gdk.pixbuf_new_from_file(themed_image)
+        scaled = {}
         def draw_background(widget, ev):
             alloc = widget.get_allocation()
-            pb = img.scale_simple(alloc.width, alloc.height,
-                                  gtk.gdk.INTERP_BILINEAR)
-            widget.window.draw_pixbuf(
-                widget.style.bg_gc[gtk.STATE_NORMAL],
-                pb, 0, 0, alloc.x, alloc.y)
+            # Only rescale when the size changes, not on every expose.
+            # The first time round, the (disk) cache usually already has
+            # the image at the right size; after that the window is being
+            # resized, so scale the original ourselves.
+            size = (alloc.width, alloc.height)
+            if 'size' not in scaled:
+                scaled['size'] = size
+                scaled['pixbuf'] = self._load_pixbuf(image, size)
+            elif scaled['size'] != size:
+                scaled['size'] = size
+                scaled['pixbuf'] = self._load_pixbuf(image).scale_simple(
+                    alloc.width, alloc.height, gtk.gdk.INTERP_BILINEAR)
+            # Only redraw the damaged part of the window.
+            area = ev.area.intersect(alloc)
+            if area.width > 0 and area.height > 0:
+                widget.window.draw_pixbuf(
+                    widget.style.bg_gc[gtk.STATE_NORMAL],
+                    scaled['pixbuf'],
+                    area.x - alloc.x, area.y - alloc.y,
+                    area.x, area.y, area.width, area.height)
             if (hasattr(widget, 'get_child') and
                     widget.get_child() is not None):
                 widget.propagate_expose(widget.get_child(), ev)
@@ -116,52 +184,47 @@ class GtkBaseGUI(BaseGUI):
 
     def _set_status_display_icon(self, status, icon_path, size=32):
         if 'icon' in status:
-            themed_icon = self._theme_image(icon_path)
-            img = gtk.gdk.pixbuf_new_from_file(themed_icon)
-            img = img.scale_simple(size, size, gtk.gdk.INTERP_BILINEAR)
+            img = self._load_pixbuf(icon_path, (size, size))
             status['icon'].set_from_pixbuf(img)
             status['icon_size'] = size
 
     def _main_window_default_style(self):
         wcfg = self.config['main_window']
 
-        button_style = self.config.get('font_styles', {}).get('buttons', {})
-        border_padding = int(2 * button_style.get('points', 10) / 3)
+        button_style = self._config.fonts.get('buttons')
+        border_padding = int(2 * (button_style.points if button_style
+                                  else 10) / 3)
 
         vbox = gtk.VBox(False, 0)
         vbox.set_border_width(border_padding)
 
         # Enforce that the window always has at least one status section,
         # even if the configuration doesn't specify one.
-        sd_defs = wcfg.get("status_displays") or [{
-            "id": "notification",
-            "details": wcfg.get('initial_notification', '')}]
+        sd_defs = self._config.status_displays or [
+            self._config.status_display({
+                "id": "notification",
+                "details": wcfg.get('initial_notification', '')})]
 
-        # Scale the status icons relative to a) how tall the window is,
-        # and b) how many status lines we are showing.
-        icon_size = int(0.66 * wcfg.get('height', 360) / len(sd_defs))
+        icon_size = self._status_icon_size()
 
         status_displays = []
         for st in sd_defs:
             ss = {
-                'id': st['id'],
+                'id': st.id,
                 'hbox': gtk.HBox(False, border_padding),
                 'vbox': gtk.VBox(False, border_padding),
                 'title': gtk.Label(),
                 'details': gtk.Label()}
 
             for which in ('title', 'details'):
-                ss[which].set_markup(st.get(which, ''))
-                exact = '%s_%s' % (ss['id'], which)
-                if exact in self.font_styles:
-                    ss[which].modify_font(self.font_styles[exact])
-                elif which in self.font_styles:
-                    ss[which].modify_font(self.font_styles[which])
-
-            if 'icon' in st:
+                ss[which].set_markup(getattr(st, which))
+                if st.fonts[which]:
+                    ss[which].modify_font(self.font_styles[st.fonts[which]])
+
+            if st.icon:
                 ss['icon'] = gtk.Image()
                 ss['hbox'].pack_start(ss['icon'], False, True)
-                self._set_status_display_icon(ss, st['icon'], icon_size)
+                self._set_status_display_icon(ss, st.icon, icon_size)
                 text_x = 0.0
             else:
                 # If there is no icon, center our title and details
@@ -339,7 +402,8 @@ class GtkBaseGUI(BaseGUI):
             wait_lock.acquire()
 
     def notify_user(self,
-            message='Hello', popup=False, alert=False, actions=None):
+            message='Hello', popup=False, alert=False, actions=None,
+            category=None):
         # FIXME: Can we do something for alerts? Actions?
         def notify(self):
             # We always update the indicator status with the latest
@@ -353,24 +417,16 @@ class GtkBaseGUI(BaseGUI):
                 if 'app_icon' in self.config:
                     popup_icon = self._theme_image(self.config['app_icon'])
                 popup_appname = self.config.get('app_name', 'gui-o-matic')
-                if pynotify is not None:
-                    if self.popup is None:
-                        self.popup = pynotify.Notification(
-                            popup_appname, message, popup_icon)
-                        self.popup.set_urgency(pynotify.URGENCY_NORMAL)
-                    self.popup.update(popup_appname, message, popup_icon)
-                    self.popup.show()
-                    return
-                elif not self.config.get('disable-popup-fallback'):
-                    try:
-                        if self._spawn([
-                                    'notify-send',
-                                    '-i', popup_icon, popup_appname,
-                                    message],
-                                report_errors=False):
-                            return
-                    except:
-                        print('FIXME: Should popup: %s' % message)
+                try:
+                    notifier = self._popup_notifier()
+                    if notifier is not None:
+                        # Only popups of the same kind get merged
+                        key = category or ('alert' if alert else 'default')
+                        notifier.notify(popup_appname, message, popup_icon,
+                                        key=key)
+                        return
+                except:
+                    print('FIXME: Should popup: %s' % message)
 
             # Note: popups also fall through to here if we can't pop up
             if self.splash:
@@ -382,14 +438,28 @@ class GtkBaseGUI(BaseGUI):
                 print('FIXME: Notify: %s' % message)
         gobject.idle_add(notify, self)
 
+    def _popup_notifier(self):
+        if self._notifier is None:
+            spawn = None
+            if not self.config.get('disable-popup-fallback'):
+                spawn = self._spawn
+            backend = best_backend(
+                self.config.get('app_name', 'gui-o-matic'), spawn)
+            if backend is None:
+                return None
+            self._notifier = NotificationManager(
+                backend,
+                budget=self.config.get('notify_budget', self.NOTIFY_BUDGET),
+                period=self.config.get('notify_period', self.NOTIFY_PERIOD),
+                dispatch=self._idle)
+        return self._notifier
+
     def _indicator_setup(self):
         pass
 
     def _indicator_set_icon(self, icon, **kwargs):
         if 'indicator_icon' in self.main_window:
-            themed_icon = self._theme_image(icon)
-            img = gtk.gdk.pixbuf_new_from_file(themed_icon)
-            img = img.scale_simple(32, 32, gtk.gdk.INTERP_BILINEAR)
+            img = self._load_pixbuf(icon, (32, 32))
             self.main_window['indicator_icon'].set_from_pixbuf(img)
 
     def _indicator_set_status(self, status, **kwargs):
@@ -404,13 +474,9 @@ class GtkBaseGUI(BaseGUI):
             do = lambda o, a: o(a)
         else:
             do = gobject.idle_add
-        images = self.config.get('images')
-        if images:
-            icon = images.get(status)
-            if not icon:
-                icon = images.get('normal')
-            if icon:
-                self._indicator_set_icon(icon, do=do)
+        icon = self._config.status_image(status)
+        if icon:
+            self._indicator_set_icon(icon, do=do)
         self._indicator_set_status(status, do=do)
 
     def set_status_display(self,
@@ -446,21 +512,32 @@ class GtkBaseGUI(BaseGUI):
             gobject.idle_add(self.items[id].set_sensitive, sensitive)
 
     def _font_setup(self):
-        for name, style in self.config.get('font_styles', {}).iteritems():
+        for name, style in self._config.fonts.iteritems():
             pfd = pango.FontDescription()
-            pfd.set_family(style.get('family', 'normal'))
-            pfd.set_size(style.get('points', 12) * pango.SCALE)
-            if style.get('italic'): pfd.set_style(pango.STYLE_ITALIC)
-            if style.get('bold'): pfd.set_weight(pango.WEIGHT_BOLD)
+            pfd.set_family(style.family)
+            pfd.set_size(style.points * pango.SCALE)
+            if style.italic: pfd.set_style(pango.STYLE_ITALIC)
+            if style.bold: pfd.set_weight(pango.WEIGHT_BOLD)
             self.font_styles[name] = pfd
 
     def run(self):
-        self._font_setup()
-        self._menu_setup()
+        self._prerender_images()
+        with startup.timed('_font_setup'):
+            self._font_setup()
+        if self.config.get('splash_screen'):
+            with startup.timed('splash_screen'):
+                self.show_splash_screen(
+                    _now=True, **self.config['splash_screen'])
+                while gtk.events_pending():
+                    gtk.main_iteration(False)
+        with startup.timed('_menu_setup'):
+            self._menu_setup()
         if self.config.get('indicator') and self._HAVE_INDICATOR:
-            self._indicator_setup()
+            with startup.timed('_indicator_setup'):
+                self._indicator_setup()
         if self.config.get('main_window'):
-            self._main_window_setup()
+            with startup.timed('_main_window_setup'):
+                self._main_window_setup()
 
         def ready(s):
             s.ready = True
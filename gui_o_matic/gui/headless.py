@@ -0,0 +1,237 @@
+import copy
+import functools
+import inspect
+import json
+import Queue
+import threading
+import time
+
+from gui_o_matic.gui.base import BaseGUI
+
+
+def _queued(apply):
+    """
+    Public methods may be called from any thread; all they do is queue the
+    call, which the main loop then applies to our state in order. This
+    includes calls made on the main loop itself (e.g. from _idle callbacks).
+    """
+    @functools.wraps(apply)
+    def post(self, *args, **kwargs):
+        self.queue.put((apply.__name__, apply, (self,) + args, kwargs,
+                        time.time()))
+    return post
+
+
+class HeadlessGUI(BaseGUI):
+    """
+    A GUI without a display, for servers, CI and benchmarks.
+
+    This has a real main loop and command queue like the other backends,
+    but instead of drawing anything it maintains a model of what would be
+    on screen (self.state) and a structured log of every applied command
+    (self.events). If the config has a `_headless_log` path, events are
+    also appended to that file as JSON lines.
+    """
+    def __init__(self, config):
+        BaseGUI.__init__(self, config)
+        self.queue = Queue.Queue()
+        self.lock = threading.RLock()
+        self.events = []
+        self.state = self._initial_state()
+        self._log_fd = None
+
+    def _initial_state(self):
+        wcfg = self.config.get('main_window', {})
+        items = {}
+        for item in self._config.menu_items + self._config.action_items:
+            if item.id:
+                items[item.id] = {
+                    'label': item.label,
+                    'sensitive': item.sensitive,
+                    'op': item.op,
+                    'args': item.args}
+        displays = {}
+        for sd in self._config.status_displays:
+            displays[sd.id] = {
+                'title': sd.title,
+                'details': sd.details,
+                'icon': sd.icon,
+                'color': None}
+        return {
+            'status': self.config.get('indicator', {}).get(
+                'initial_status', 'startup'),
+            'badge': None,
+            'icon': None,
+            'items': items,
+            'status_displays': displays,
+            'splash': None,
+            'main_window': {
+                'visible': bool(wcfg.get('show')),
+                'notification': wcfg.get('initial_notification', '')},
+            'notifications': [],
+            'urls': [],
+            'terminals': []}
+
+    def _snapshot(self):
+        """Return a copy of the current state, for making assertions."""
+        with self.lock:
+            return copy.deepcopy(self.state)
+
+    def _events(self, method=None):
+        with self.lock:
+            return [e for e in self.events
+                    if method is None or e['method'] == method]
+
+    def _sync(self, timeout=None):
+        """Wait until everything queued so far has been applied."""
+        done = threading.Event()
+        self._idle(done.set)
+        return done.wait(timeout)
+
+    def _idle(self, callback, *args):
+        self.queue.put((None, callback, args, {}, time.time()))
+
+    def _activate(self, id):
+        """Simulate the user clicking on a menu item or button."""
+        item = self.state['items'][id]
+        if item['sensitive'] and item['op']:
+            self._do(item['op'], item['args'] or [])
+
+    def _log_event(self, method, kwargs, queued):
+        event = {'time': time.time(), 'queued': queued,
+                 'method': method, 'args': kwargs}
+        self.events.append(event)
+        if self._log_fd is not None:
+            self._log_fd.write(json.dumps(event) + '\n')
+
+    def _apply(self, method, func, args, kwargs, queued):
+        try:
+            with self.lock:
+                func(*args, **kwargs)
+                if method:
+                    # Log positional arguments by name too
+                    callargs = inspect.getcallargs(func, *args, **kwargs)
+                    callargs.pop('self', None)
+                    self._log_event(method, callargs, queued)
+        except Exception, e:
+            self._report_error(e)
+
+    def run(self):
+        if self.config.get('_headless_log'):
+            self._log_fd = open(self.config['_headless_log'], 'a', 1)
+        if self.config.get('splash_screen'):
+            self.show_splash_screen(**self.config['splash_screen'])
+        self.ready = True
+        try:
+            while True:
+                method, func, args, kwargs, queued = self.queue.get()
+                if func is None:
+                    break
+                self._apply(method, func, args, kwargs, queued)
+            # Calls posted by callbacks just before the quit (such as the
+            # last coalesced flush at end of file) are queued behind it.
+            while True:
+                try:
+                    method, func, args, kwargs, queued = self.queue.get_nowait()
+                except Queue.Empty:
+                    break
+                if func is not None:
+                    self._apply(method, func, args, kwargs, queued)
+        finally:
+            self.ready = False
+            if self._log_fd is not None:
+                self._log_fd.close()
+
+    def quit(self):
+        self.queue.put((None, None, (), {}, time.time()))
+
+    @_queued
+    def set_status(self, status=None, badge=None):
+        if status is not None:
+            self.state['status'] = status
+            self.state['icon'] = self._config.status_image(status)
+        if badge is not None:
+            self.state['badge'] = badge
+
+    @_queued
+    def set_item(self, id=None, label=None, sensitive=None):
+        item = self.state['items'].get(id)
+        if item is not None:
+            if label is not None:
+                item['label'] = label
+            if sensitive is not None:
+                item['sensitive'] = sensitive
+
+    @_queued
+    def set_status_display(self,
+            id=None, title=None, details=None, icon=None, color=None):
+        display = self.state['status_displays'].get(id)
+        if display is not None:
+            if icon:
+                display['icon'] = self._theme_image(icon)
+            for key, value in (('title', title),
+                               ('details', details),
+                               ('color', color)):
+                if value:
+                    display[key] = value
+
+    @_queued
+    def show_splash_screen(self, height=None, width=None,
+                           progress_bar=False, background=None,
+                           message=None, message_x=0.5, message_y=0.5):
+        self.state['splash'] = {
+            'width': width or 240,
+            'height': height or 320,
+            'background': background and self._theme_image(background),
+            'message': message or '',
+            'progress': 0.0 if progress_bar else None}
+
+    @_queued
+    def update_splash_screen(self, progress=None, message=None):
+        splash = self.state['splash']
+        if splash:
+            if message is not None:
+                splash['message'] = message
+            if progress is not None and splash['progress'] is not None:
+                splash['progress'] = progress
+
+    @_queued
+    def hide_splash_screen(self):
+        self.state['splash'] = None
+
+    @_queued
+    def show_main_window(self):
+        self.state['main_window']['visible'] = True
+
+    @_queued
+    def hide_main_window(self):
+        self.state['main_window']['visible'] = False
+
+    @_queued
+    def show_url(self, url=None):
+        assert(url is not None)
+        self.state['urls'].append(url)
+
+    @_queued
+    def terminal(self, command='/bin/bash', title=None, icon=None):
+        self.state['terminals'].append(command)
+
+    @_queued
+    def notify_user(self,
+            message='Hello', popup=False, alert=False, actions=None,
+            category=None):
+        self.state['notifications'].append({
+            'message': message,
+            'popup': popup,
+            'alert': alert,
+            'actions': actions,
+            'category': category})
+        if 'notification' in self.state['items']:
+            self.state['items']['notification']['label'] = message
+        if self.state['splash']:
+            self.state['splash']['message'] = message
+        else:
+            self.state['main_window']['notification'] = message
+
+
+GUI = HeadlessGUI
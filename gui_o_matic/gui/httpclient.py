@@ -0,0 +1,134 @@
+import base64
+import httplib
+import socket
+import threading
+import urllib
+import urlparse
+
+from gui_o_matic.gui.workers import WorkerPool
+
+
+class HTTPClient(object):
+    """
+    Background HTTP client for the get_url and post_url actions.
+
+    Requests run on a bounded worker pool, so they never block the GUI
+    thread. Connections are kept alive and reused per (scheme, host), and
+    responses are read into memory. The connection classes can be replaced
+    (e.g. to talk to a local stand-in server) via connection_classes.
+
+    Like urllib, this honours the http_proxy, https_proxy and no_proxy
+    environment variables (or pass `proxies`, a {scheme: proxy URL} dict).
+    HTTPS goes through the proxy with CONNECT.
+    """
+    connection_classes = {
+        'http': httplib.HTTPConnection,
+        'https': httplib.HTTPSConnection}
+
+    def __init__(self, max_workers=4, timeout=30, max_idle=2, on_error=None,
+                 proxies=None):
+        self.pool = WorkerPool(max_workers, on_error, name='http')
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.proxies = urllib.getproxies() if proxies is None else proxies
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def _proxy(self, scheme, netloc):
+        """
+        Return (proxy host:port, extra headers) for a request, or None if
+        it should go direct.
+        """
+        proxy = self.proxies.get(scheme)
+        if not proxy or urllib.proxy_bypass(netloc):
+            return None
+        parts = urlparse.urlsplit(proxy if '//' in proxy else '//' + proxy)
+        headers = {}
+        if parts.username is not None:
+            auth = '%s:%s' % (urllib.unquote(parts.username),
+                              urllib.unquote(parts.password or ''))
+            headers['Proxy-Authorization'] = (
+                'Basic ' + base64.b64encode(auth))
+        host = parts.hostname
+        if parts.port:
+            host = '%s:%d' % (host, parts.port)
+        return host, headers
+
+    def _checkout(self, key):
+        with self.lock:
+            if self.idle.get(key):
+                return self.idle[key].pop(), True
+        scheme, netloc = key
+        if scheme not in self.connection_classes:
+            raise IOError('Unsupported URL scheme: %s' % scheme)
+        proxy = self._proxy(scheme, netloc)
+        if proxy is None:
+            return self.connection_classes[scheme](
+                netloc, timeout=self.timeout), False
+        proxy_netloc, proxy_headers = proxy
+        if scheme == 'https':
+            conn = self.connection_classes[scheme](
+                proxy_netloc, timeout=self.timeout)
+            conn.set_tunnel(netloc, headers=proxy_headers)
+        else:
+            conn = self.connection_classes['http'](
+                proxy_netloc, timeout=self.timeout)
+        return conn, False
+
+    def _checkin(self, key, conn):
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, url, body=None, headers=None):
+        """
+        Perform a request right away, returning (status, headers, body).
+        """
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = urlparse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+        headers = dict(headers or {})
+        proxy = self._proxy(parts.scheme, parts.netloc)
+        if proxy is not None and parts.scheme == 'http':
+            # Plain HTTP proxies want the whole URL
+            path = urlparse.urlunsplit(parts[:4] + ('',))
+            headers.update(proxy[1])
+        while True:
+            conn, reused = self._checkout(key)
+            try:
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if reused:
+                    # The server may have closed an idle kept-alive
+                    # connection; retry on a fresh one.
+                    continue
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._checkin(key, conn)
+            return response.status, response.msg, data
+
+    def submit(self, method, url, body=None, headers=None, callback=None):
+        """
+        Queue a request; callback(status, headers, body) is invoked on a
+        worker thread when it completes.
+        """
+        def job():
+            result = self.request(method, url, body, headers)
+            if callback is not None:
+                callback(*result)
+        self.pool.submit(job)
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
@@ -0,0 +1,75 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+class ImageCache(object):
+    """
+    A bounded LRU cache of decoded (and possibly scaled) images.
+
+    Entries are keyed by path, file modification time, target size and an
+    optional kind (for backends which keep several representations of the
+    same image), so editing an image on disk invalidates it. Each entry is
+    charged an estimated size in bytes, and the least recently used entries
+    are evicted when the total exceeds max_bytes.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions}
+
+    def get(self, path, size, load, nbytes=None, kind=None):
+        """
+        Return the image for path at the given size, calling load(path, size)
+        if it is not already cached. The nbytes(image) function estimates
+        memory use; by default we assume 4 bytes per pixel of `size`.
+        """
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        key = (path, mtime, size, kind)
+
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.entries[key] = entry
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        image = load(path, size)
+        if nbytes is not None:
+            cost = nbytes(image)
+        elif isinstance(size, tuple):
+            cost = size[0] * size[1] * 4
+        else:
+            cost = 0
+
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = (image, cost)
+                self.bytes += cost
+                while self.bytes > self.max_bytes and len(self.entries) > 1:
+                    evicted, (img, evicted_cost) = self.entries.popitem(
+                        last=False)
+                    self.bytes -= evicted_cost
+                    self.evictions += 1
+        return image
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
@@ -83,7 +83,8 @@ class MacOSXGUI(BaseGUI):
             self.items[id].setEnabled_(sensitive)
 
     def notify_user(self,
-            message=None, popup=False, alert=False, actions=None):
+            message=None, popup=False, alert=False, actions=None,
+            category=None):
         pass  # FIXME
 
     def run(self):
@@ -0,0 +1,145 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class PyNotifyBackend(object):
+    """Desktop notifications via libnotify, reusing one object per key."""
+    def __init__(self, app_name):
+        import pynotify
+        if not pynotify.init(app_name):
+            raise OSError('pynotify.init failed')
+        self.pynotify = pynotify
+        self.popups = {}
+
+    def show(self, key, title, message, icon):
+        popup = self.popups.get(key)
+        if popup is None:
+            popup = self.pynotify.Notification(title, message, icon)
+            popup.set_urgency(self.pynotify.URGENCY_NORMAL)
+            self.popups[key] = popup
+        popup.update(title, message, icon)
+        popup.show()
+
+
+class DBusBackend(object):
+    """Desktop notifications over D-Bus, replacing the previous per key."""
+    def __init__(self, app_name):
+        import dbus
+        self.app_name = app_name
+        self.service = dbus.Interface(
+            dbus.SessionBus().get_object('org.freedesktop.Notifications',
+                                         '/org/freedesktop/Notifications'),
+            'org.freedesktop.Notifications')
+        self.ids = {}
+
+    def show(self, key, title, message, icon):
+        self.ids[key] = self.service.Notify(
+            self.app_name, self.ids.get(key, 0), icon, title, message,
+            [], {}, -1)
+
+
+class NotifySendBackend(object):
+    """Desktop notifications by running notify-send (one process each)."""
+    def __init__(self, spawn):
+        self.spawn = spawn
+
+    def show(self, key, title, message, icon):
+        if not self.spawn(['notify-send', '-i', icon, title, message],
+                          report_errors=False, _raise=True):
+            raise OSError('notify-send failed')
+
+
+class RecordingBackend(object):
+    """A stand-in which records notifications instead of showing them."""
+    def __init__(self):
+        self.shown = []
+
+    def show(self, key, title, message, icon):
+        self.shown.append((time.time(), key, title, message, icon))
+
+
+def best_backend(app_name, spawn=None):
+    """
+    Return the best available backend: libnotify, D-Bus or notify-send (if
+    a spawn function is given), or None if there are none.
+    """
+    for backend in (PyNotifyBackend, DBusBackend):
+        try:
+            return backend(app_name)
+        except Exception:
+            pass
+    if spawn is not None:
+        return NotifySendBackend(spawn)
+    return None
+
+
+class NotificationManager(object):
+    """
+    Rate-limits and merges desktop notifications.
+
+    At most `budget` notifications are shown per `period` seconds. Beyond
+    that, messages are held per key: newer ones are merged into (up to
+    merge_lines) or replace the held notification, which is shown by a
+    trailing flush as soon as the budget allows. Backend calls go through
+    dispatch(), so toolkits can keep them on the GUI thread.
+    """
+    def __init__(self, backend, budget=3, period=5.0, merge_lines=3,
+                 dispatch=None):
+        self.backend = backend
+        self.budget = budget
+        self.period = period
+        self.merge_lines = merge_lines
+        self.dispatch = dispatch or (lambda callback: callback())
+        self.lock = threading.RLock()
+        self.shown_at = []
+        self.pending = OrderedDict()
+        self.timer = None
+        self.requested = 0
+        self.shown = 0
+
+    def stats(self):
+        return {'requested': self.requested,
+                'shown': self.shown,
+                'pending': len(self.pending)}
+
+    def _wait_time(self, now):
+        self.shown_at = [t for t in self.shown_at if t > now - self.period]
+        if len(self.shown_at) < self.budget:
+            return 0
+        return self.shown_at[0] + self.period - now
+
+    def notify(self, title, message, icon, key='default'):
+        with self.lock:
+            self.requested += 1
+            if key in self.pending:
+                held = self.pending[key][1].split('\n')
+                lines = (held + [message])[-self.merge_lines:]
+                message = '\n'.join(lines)
+            self.pending[key] = (title, message, icon)
+            if self.timer is None:
+                self.flush()
+
+    def flush(self):
+        """Show as many held notifications as the budget allows."""
+        with self.lock:
+            self.timer = None
+            while self.pending:
+                wait = self._wait_time(time.time())
+                if wait > 0:
+                    self.timer = threading.Timer(
+                        wait, self.dispatch, [self.flush])
+                    self.timer.daemon = True
+                    self.timer.start()
+                    return
+                key, (title, message, icon) = self.pending.popitem(last=False)
+                self.shown_at.append(time.time())
+                self.shown += 1
+                self.backend.show(key, title, message, icon)
+
+    def cancel(self):
+        with self.lock:
+            self.pending.clear()
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
@@ -0,0 +1,75 @@
+import threading
+import traceback
+
+
+class ChildReaper(object):
+    """
+    Waits for spawned child processes on a single background thread.
+
+    Rather than dedicating a thread to each proc.wait(), all watched
+    processes are polled from one loop, which backs off while nothing
+    exits and sleeps until woken when there is nothing to watch. When a
+    process exits, callback(proc, returncode) is invoked on the reaper
+    thread; errors are passed to on_error (if any).
+    """
+    POLL_MIN = 0.02
+    POLL_MAX = 0.5
+
+    def __init__(self, on_error=None):
+        self.on_error = on_error
+        self.cond = threading.Condition()
+        self.procs = []
+        self.reaped = 0
+        self.thread = None
+
+    def watch(self, proc, callback=None):
+        with self.cond:
+            self.procs.append((proc, callback))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run,
+                                               name='reaper')
+                self.thread.daemon = True
+                self.thread.start()
+            self.cond.notify()
+
+    def live_count(self):
+        with self.cond:
+            return len(self.procs)
+
+    def _poll(self):
+        with self.cond:
+            exited, running = [], []
+            for proc, callback in self.procs:
+                if proc.poll() is None:
+                    running.append((proc, callback))
+                else:
+                    exited.append((proc, callback))
+            self.procs = running
+            self.reaped += len(exited)
+        for proc, callback in exited:
+            try:
+                if callback is not None:
+                    callback(proc, proc.returncode)
+            except Exception, e:
+                if self.on_error is not None:
+                    self.on_error(e)
+                else:
+                    traceback.print_exc()
+        return len(exited)
+
+    def _run(self):
+        delay = self.POLL_MIN
+        while True:
+            with self.cond:
+                while not self.procs:
+                    self.cond.wait()
+                    delay = self.POLL_MIN
+            if self._poll():
+                delay = self.POLL_MIN
+            else:
+                delay = min(delay * 2, self.POLL_MAX)
+            with self.cond:
+                if self.procs:
+                    # watch() wakes us early, so new processes which exit
+                    # quickly are reaped quickly.
+                    self.cond.wait(delay)
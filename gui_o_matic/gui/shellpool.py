@@ -0,0 +1,89 @@
+import os
+import signal
+import subprocess
+import threading
+
+from gui_o_matic.gui.workers import WorkerPool
+
+
+class ShellError(OSError):
+    def __init__(self, command, returncode, output):
+        OSError.__init__(self, 'Failed with exit code %d: %s%s' % (
+            returncode, command,
+            (' (%s)' % last_line(output)) if output.strip() else ''))
+        self.command = command
+        self.returncode = returncode
+        self.output = output
+
+
+def last_line(output):
+    lines = [l for l in output.splitlines() if l.strip()]
+    return lines[-1].strip() if lines else ''
+
+
+class ShellPool(object):
+    """
+    Runs shell actions on a bounded worker pool, off the GUI thread.
+
+    Each action is a list of commands which run in order, stopping at the
+    first failure. Output (stdout and stderr) is captured, and commands
+    which run longer than the timeout are killed along with any children.
+    """
+    def __init__(self, max_workers=2, timeout=300, on_error=None):
+        self.pool = WorkerPool(max_workers, on_error, name='shell')
+        self.timeout = timeout
+
+    def _kill(self, proc, expired):
+        expired.append(True)
+        try:
+            if os.name == 'nt':
+                proc.kill()
+            else:
+                os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    def run(self, command, timeout=None):
+        """
+        Run a single command right away, returning (exit code, output).
+        """
+        timeout = timeout or self.timeout
+        with open(os.devnull, 'rb') as devnull:
+            proc = subprocess.Popen(
+                command,
+                shell=True,
+                stdin=devnull,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                close_fds=(os.name != 'nt'),  # Doesn't work on windows!
+                # A process group of its own, so we can kill the lot
+                preexec_fn=(os.setsid if os.name != 'nt' else None))
+
+        expired = []
+        timer = threading.Timer(timeout, self._kill, [proc, expired])
+        timer.daemon = True
+        timer.start()
+        try:
+            output = proc.communicate()[0]
+        finally:
+            timer.cancel()
+        if expired:
+            raise OSError('Timed out after %ds: %s' % (timeout, command))
+        return proc.returncode, output
+
+    def submit(self, commands, callback=None):
+        """
+        Queue a list of commands to run in order. When all have succeeded,
+        callback(output) is invoked on the worker thread; failures raise a
+        ShellError, which is passed to on_error.
+        """
+        def job():
+            output = []
+            for command in commands:
+                rv, out = self.run(command)
+                output.append(out)
+                if rv != 0:
+                    raise ShellError(command, rv, out)
+            if callback is not None:
+                callback(''.join(output))
+        self.pool.submit(job)
@@ -13,7 +13,6 @@ import ctypes
 # Utility imports
 #
 import re
-import tempfile
 import PIL.Image
 import os
 import uuid
@@ -31,14 +30,64 @@ import pil_bmp_fix
 BMP_FORMAT = "BMP+ALPHA"
 PIL.Image.register_save( BMP_FORMAT, pil_bmp_fix._save )
 
+from gui_o_matic.gui import bmpencode, dib
 from gui_o_matic.gui.base import BaseGUI
+from gui_o_matic.gui.compositor import Compositor, rect_intersect
 
-def rect_intersect( rect_a, rect_b ):
-    x_min = max(rect_a[0], rect_b[0])
-    y_min = max(rect_a[1], rect_b[1])
-    x_max = min(rect_a[2], rect_b[2])
-    y_max = min(rect_a[3], rect_b[3])
-    return (x_min, y_min, x_max, y_max)
+# Create bitmaps and icons straight from memory, using ctypes for the calls
+# pywin32 doesn't wrap (or wraps without the size arguments we need).
+#
+_gdi32 = ctypes.windll.gdi32
+_gdi32.CreateDIBSection.restype = ctypes.c_void_p
+_gdi32.CreateDIBSection.argtypes = [ ctypes.c_void_p, ctypes.c_char_p,
+                                     ctypes.c_uint,
+                                     ctypes.POINTER( ctypes.c_void_p ),
+                                     ctypes.c_void_p, ctypes.c_uint ]
+_user32 = ctypes.windll.user32
+_user32.CreateIconFromResourceEx.restype = ctypes.c_void_p
+_user32.CreateIconFromResourceEx.argtypes = [ ctypes.c_char_p, ctypes.c_uint,
+                                              ctypes.c_int, ctypes.c_uint,
+                                              ctypes.c_int, ctypes.c_int,
+                                              ctypes.c_uint ]
+
+def bitmap_from_bmp( data ):
+    '''
+    Create a DIB section from BMP file data
+    '''
+    info, offset = dib.bmp_layout( data )
+    bits = ctypes.c_void_p()
+    handle = _gdi32.CreateDIBSection( None,
+                                      bytes( info ),
+                                      win32con.DIB_RGB_COLORS,
+                                      ctypes.byref( bits ),
+                                      None,
+                                      0 )
+    if not handle:
+        raise ctypes.WinError()
+    size = len( data ) - offset
+    if isinstance( data, bytearray ):
+        # Copy straight out of the encoder's buffer
+        pixels = (ctypes.c_char * size).from_buffer( data, offset )
+    else:
+        pixels = data[ offset: ]
+    ctypes.memmove( bits, pixels, size )
+    return handle
+
+def icon_from_ico( data, size ):
+    '''
+    Create an icon from the best matching image in ICO file data
+    '''
+    width, height, bpp, resource = dib.ico_best_entry( data, size )
+    handle = _user32.CreateIconFromResourceEx( bytes( resource ),
+                                               len( resource ),
+                                               True,
+                                               0x00030000, # Version, fixed
+                                               size[0],
+                                               size[1],
+                                               win32con.LR_DEFAULTCOLOR )
+    if not handle:
+        raise ctypes.WinError()
+    return handle
 
 class Image( object ):
     '''
@@ -70,7 +119,7 @@ class Image( object ):
         size = tuple(map(win32api.GetSystemMetrics,dims))
         return cls.Icon( *args, size = size, **kwargs )
 
-    def __init__( self, path, mode, size = None, debug = None ):
+    def __init__( self, path, mode, size = None, debug = None, cache = None ):
         '''
         Load the image into memory, with appropriate conversions.
 
@@ -78,40 +127,50 @@ class Image( object ):
           None: use image size
           number: scale image size
           tuple: transform image size
+
+        cache:
+          None, or a function (path, size, format, render) returning the
+          encoded image, e.g. BaseGUI._disk_cached
         '''
-        if isinstance( path, PIL.Image.Image ):
-            source = path
-        else:
-            source = PIL.Image.open( path )
-            
-        if source.mode != 'RGBA':
-            source = source.convert( 'RGBA' )
-        if size:
-            if not hasattr( size, '__len__' ):
-                factor = float( size ) / max( source.size )
-                size = tuple([ int(factor * dim) for dim in source.size ])
-            source = source.resize( size, PIL.Image.ANTIALIAS )
-            #source.thumbnail( size, PIL.Image.ANTIALIAS )
-
-        self.size = source.size
-        self.mode = mode
+        def render():
+            if isinstance( path, PIL.Image.Image ):
+                source = path
+            else:
+                source = PIL.Image.open( path )
+
+            if source.mode != 'RGBA':
+                source = source.convert( 'RGBA' )
+            target = size
+            if target:
+                if not hasattr( target, '__len__' ):
+                    factor = float( target ) / max( source.size )
+                    target = tuple([ int(factor * dim) for dim in source.size ])
+                source = source.resize( target, PIL.Image.ANTIALIAS )
+                #source.thumbnail( target, PIL.Image.ANTIALIAS )
+
+            if debug:
+                source.save( debug, mode[ 1 ] )
+
+            # Serialize in memory and create the handle from that; no temp files
+            #
+            if mode[ 0 ] == win32con.IMAGE_ICON:
+                return bmpencode.ico( [ source ] )
+            else:
+                return bmpencode.bmp( source )
 
-        if debug:
-            source.save( debug, mode[ 1 ] )
-        
-        with tempfile.NamedTemporaryFile( delete = False ) as handle:
-            filename = handle.name
-            source.save( handle, mode[ 1 ] )
+        if cache is None or isinstance( path, PIL.Image.Image ):
+            data = render()
+        else:
+            data = cache( path, size, mode[ 1 ], render )
 
-        try:
-            self.handle = win32gui.LoadImage( None,
-                                              handle.name,
-                                              mode[ 0 ],
-                                              source.width,
-                                              source.height,
-                                              win32con.LR_LOADFROMFILE )#| win32con.LR_CREATEDIBSECTION )
-        finally:
-            os.unlink( filename )
+        self.mode = mode
+        if mode[ 0 ] == win32con.IMAGE_ICON:
+            width, height, bpp, ignored = dib.ico_entries( data )[ 0 ]
+            self.size = (width, height)
+            self.handle = icon_from_ico( data, self.size )
+        else:
+            self.size = dib.bmp_size( data )
+            self.handle = bitmap_from_bmp( data )
 
     def __del__( self ):
         # TODO: swap mode to a more descriptive structure
@@ -119,61 +178,6 @@ class Image( object ):
         #self.mode[2]( self.handle )
         pass
 
-class Compositor( object ):
-    '''
-    Alpha-blend compatability class.
-
-    Since we're having trouble getting alpha into winapi objects, blend images
-    in python, then move them out to winapi as RGB
-    '''
-
-    class Operation( object ):
-        '''
-        Applies and effect to an image
-        '''
-
-    class Fill( Operation ):
-        '''
-        Stretches the target region with the specified color.
-        '''
-
-        def __init__( self, color, rect = None ):
-            self.rect = rect
-            self.color = color
-
-        def __call__( self, image ):
-            rect = self.rect or (0, 0, image.width, image.height)
-            image.paste( self.color, rect )
-            
-    class Blend( Operation ):
-
-        def __init__( self, source, rect = None ):
-            self.set_image( source )
-            self.rect = rect
-
-        def set_image( self, source ):
-            self.source = source if source.mode == "RGBA" else source.convert("RGBA")
-
-        def __call__( self, image ):
-            rect = self.rect or (0, 0, image.width, image.height)
-            dst_size = (rect[2] - rect[0], rect[3] - rect[1])
-            if dst_size != self.source.size:
-                scaled = self.source.resize( dst_size, PIL.Image.ANTIALIAS )
-            else:
-                scaled = self.source
-            dst = image.crop( rect )
-            blend = dst.alpha_composite( scaled )
-            image.paste( dst, rect )
-
-    def render( self, size, background = (0,0,0,0) ):
-        image = PIL.Image.new( "RGBA", size, background )
-        for operation in self.operations:
-            operation( image )
-        return image
-
-    def __init__( self ):
-        self.operations = []
-
 class Registry( object ):
     '''
     Registry that maps objects to IDs
@@ -284,11 +288,13 @@ class Window( object ):
     class CompositorLayer( Layer, Compositor ):
         '''
         Layer that moves compositor output into an HDC, caching rendering.
+        Only the regions which changed since the last paint are re-composited
+        and copied into the cached bitmap.
         '''
 
         def __init__( self, rect = None, background = None ):
             super(Window.CompositorLayer, self).__init__()
-            self.image = None
+            self.bitmap = None
             self.rect = rect
             self.background = background
 
@@ -308,18 +314,46 @@ class Window( object ):
                      (background >> 16 ) & 255,
                      255)
             size = ( rect[2] - rect[0], rect[3] - rect[1] )
-            combined = self.render( size, color )
-            self.image = Image.Bitmap( combined )
+            changed = self.composite( size, color )
+            if self.bitmap is None or changed == [ (0, 0) + size ]:
+                self.bitmap = Image.Bitmap( self.image )
+            else:
+                for roi in changed:
+                    self.upload( hdc, roi )
+
+        def upload( self, hdc, roi ):
+            '''
+            Copy a region of the composited image into the cached bitmap
+            '''
+            patch = Image.Bitmap( self.image.crop( roi ) )
+            hdc_dst = win32gui.CreateCompatibleDC( hdc )
+            hdc_src = win32gui.CreateCompatibleDC( hdc )
+            prior_dst = win32gui.SelectObject( hdc_dst, self.bitmap.handle )
+            prior_src = win32gui.SelectObject( hdc_src, patch.handle )
+
+            win32gui.BitBlt( hdc_dst,
+                             roi[0],
+                             roi[1],
+                             roi[2] - roi[0],
+                             roi[3] - roi[1],
+                             hdc_src,
+                             0,
+                             0,
+                             win32con.SRCCOPY )
+
+            win32gui.SelectObject( hdc_src, prior_src )
+            win32gui.SelectObject( hdc_dst, prior_dst )
+            win32gui.DeleteDC( hdc_src )
+            win32gui.DeleteDC( hdc_dst )
+            win32gui.DeleteObject( patch.handle )
 
         def dirty( self, window ):
             rect = self.rect or window.get_client_region()
             size = ( rect[2] - rect[0], rect[3] - rect[1] )
-            result = self.image is None or self.image.size != size
-            return result
+            return (self.bitmap is None or
+                    self.bitmap.size != size or
+                    self.damaged != [])
 
-        def invalidate( self ):
-            self.image = None
-            
         def __call__( self, window, hdc, paint_struct ):
             dirty = self.dirty( window )
             if dirty:
@@ -328,7 +362,7 @@ class Window( object ):
             rect = self.rect or window.get_client_region()
             roi = rect_intersect( rect, paint_struct[2] )
             hdc_mem = win32gui.CreateCompatibleDC( hdc )
-            prior_bitmap = win32gui.SelectObject( hdc_mem, self.image.handle )
+            prior_bitmap = win32gui.SelectObject( hdc_mem, self.bitmap.handle )
 
             win32gui.BitBlt( hdc,
                              roi[0],
@@ -909,6 +943,7 @@ class WinapiGUI(BaseGUI):
         self.ready = False
         self.statuses = {}
         self.items = {}
+        self._image_paths = {}
         
     def layout_displays( self, padding = 10 ):
         '''
@@ -1179,7 +1214,7 @@ class WinapiGUI(BaseGUI):
         for display in self.displays.values():
             layers = ( display.title, display.details )
             self.main_window.layers.extend( layers )
-            self.compositor.operations.append( display.icon )
+            self.compositor.add( display.icon )
 
     def _process_queue( self, *ignored ):
         '''
@@ -1198,10 +1233,19 @@ class WinapiGUI(BaseGUI):
         '''
         win32gui.PostMessage( self.systray_window.window_handle, self.WM_USER_QUEUE, 0, 0 )
 
+    def _idle( self, callback, *args ):
+        '''
+        Run callback on the GUI thread, next time the queue is drained
+        '''
+        self.queue.put( functools.partial( callback, *args ) )
+        self._signal_queue()
+
     def run( self ):
         '''
         Initialize GUI and enter run loop
         '''
+        self._prerender_images()
+
         # https://stackoverflow.com/questions/1551605/how-to-set-applications-taskbar-icon-in-windows-7/1552105#1552105
         #
         self.appid = unicode( uuid.uuid4() )
@@ -1248,7 +1292,7 @@ class WinapiGUI(BaseGUI):
         try:
             background_path = self.get_image_path( self.config['main_window']['background'] )
             background = PIL.Image.open( background_path )
-            self.compositor.operations.append( Compositor.Blend( background ) )
+            self.compositor.add( Compositor.Blend( background ) )
         except KeyError:
             pass
 
@@ -1286,6 +1330,9 @@ class WinapiGUI(BaseGUI):
 
         self.set_status( 'normal' )
 
+        if self.config.get( 'splash_screen' ):
+            self.show_splash_screen( **self.config['splash_screen'] )
+
         #FIXME: Does not run!
         #
         @atexit.register
@@ -1330,10 +1377,32 @@ class WinapiGUI(BaseGUI):
     def terminal(self, command='/bin/bash', title=None, icon=None):
         print( "FIXME: Terminal not supported!" )
 
+    def _image_source( self, path ):
+        return self.get_image_path( path )
+
+    def _image_variants( self ):
+        cache = self._disk_cached
+        return [ ('small', lambda p, s: Image.IconSmall( p, cache = cache ), self._image_bytes, None),
+                 ('large', lambda p, s: Image.IconLarge( p, cache = cache ), self._image_bytes, None),
+                 (None, lambda p, s: self._open_rgba( p ), self._image_bytes, None) ]
+
+    def _open_rgba( self, path ):
+        '''
+        Decode an image to RGBA, via the disk cache (as raw pixels)
+        '''
+        header = struct.Struct( '<II' )
+        def render():
+            image = PIL.Image.open( path ).convert( 'RGBA' )
+            return header.pack( *image.size ) + image.tobytes()
+        data = self._disk_cached( path, None, 'rgba', render )
+        size = header.unpack_from( data )
+        return PIL.Image.frombytes( 'RGBA', size, data[ header.size: ] )
+
     def set_status(self, status='startup', badge = 'ignored'):
-        icon_path = self.get_image_path( self.config['images'][status] )
-        small_icon = Image.IconSmall( icon_path )
-        large_icon = Image.IconLarge( icon_path )
+        icon_path = self.get_image_path( self._config.status_image( status ) )
+        small, large, ignored = self._image_variants()
+        small_icon = self._cached_image( icon_path, *small )
+        large_icon = self._cached_image( icon_path, *large )
 
         for window in self.windows:
             window.set_icon( small_icon, large_icon )
@@ -1387,8 +1456,8 @@ class WinapiGUI(BaseGUI):
                     pass
             
         if icon is not None:
+            # Only the icon's region gets re-composited
             display.icon.source = self.open_image( icon )
-            self.compositor.invalidate()
             win32gui.InvalidateRect( self.main_window.window_handle,
                                      display.rect,
                                      True )
@@ -1402,13 +1471,24 @@ class WinapiGUI(BaseGUI):
     def set_next_error_message(self, message=None):
         self.next_error_message = message
 
+    @staticmethod
+    def _image_bytes( image ):
+        return image.size[0] * image.size[1] * 4
+
     def open_image( self, name ):
         if name:
-            return PIL.Image.open( self.get_image_path( name ) )
+            return self._cached_image( self.get_image_path( name ),
+                                       *self._image_variants()[2] )
         else:
             return PIL.Image.new("RGBA", (1,1), color = (0,0,0,0))
 
     def get_image_path( self, name ):
+        if name in self._image_paths:
+            return self._image_paths[ name ]
+        path = self._image_paths[ name ] = self._find_image_path( name )
+        return path
+
+    def _find_image_path( self, name ):
         prefix = 'image:'
         if name.startswith( prefix ):
             key = name[ len( prefix ): ]
@@ -1439,7 +1519,7 @@ class WinapiGUI(BaseGUI):
         if background:
             image = PIL.Image.open( self.get_image_path( background ) )
             background = Window.CompositorLayer()
-            background.operations.append( Compositor.Blend( image ) )
+            background.add( Compositor.Blend( image ) )
             self.splash_window.layers.append( background )
 
             if width and height:
@@ -1506,7 +1586,8 @@ class WinapiGUI(BaseGUI):
                 (self.next_error_message or 'Error: %(error)s')
                 % {'error': unicode(e)})
 
-    def notify_user(self, message, popup=False, alert = False, actions = []):
+    def notify_user(self, message, popup=False, alert = False, actions = [],
+                    category = None):
         if alert:
             win32gui.FlashWindowEx( self.main_window.window_handle,
                                     win32con.FLASHW_TRAY | win32con.FLASHW_TIMERNOFG,
@@ -1598,9 +1679,11 @@ def touchup_winapi_gui( self, proxy, queue ):
         - allow WinapiGUI to toggel proxy.ready
         - specify the async queue
         - override run to be a direct call
+        - share the idle hook, so proxy callers can queue raw callbacks
     '''
     self.proxy = proxy
     self.queue = queue
     proxy.run = self.run
+    proxy._idle = self._idle
 
 GUI = AsyncWrapper( WinapiGUI, touchup_winapi_gui, signal_gui )
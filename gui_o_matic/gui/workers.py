@@ -0,0 +1,51 @@
+import Queue
+import threading
+import traceback
+
+
+class WorkerPool(object):
+    """
+    A small, bounded pool of daemon threads for running blocking actions
+    (HTTP requests, shell commands) off the GUI thread.
+
+    Threads are started on demand, up to max_workers; jobs beyond that
+    wait in the queue. Jobs are plain callables, errors are passed to the
+    on_error callback (if any).
+    """
+    def __init__(self, max_workers=4, on_error=None, name='worker'):
+        self.max_workers = max_workers
+        self.on_error = on_error
+        self.name = name
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.workers = 0
+        self.idle = 0
+
+    def submit(self, job, *args, **kwargs):
+        with self.lock:
+            self.queue.put((job, args, kwargs))
+            if self.idle < self.queue.qsize() and (
+                    self.workers < self.max_workers):
+                self.workers += 1
+                self.idle += 1
+                worker = threading.Thread(
+                    target=self._work,
+                    name='%s-%d' % (self.name, self.workers))
+                worker.daemon = True
+                worker.start()
+
+    def _work(self):
+        while True:
+            job, args, kwargs = self.queue.get()
+            with self.lock:
+                self.idle -= 1
+            try:
+                job(*args, **kwargs)
+            except Exception, e:
+                if self.on_error is not None:
+                    self.on_error(e)
+                else:
+                    traceback.print_exc()
+            finally:
+                with self.lock:
+                    self.idle += 1
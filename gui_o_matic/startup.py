@@ -0,0 +1,73 @@
+import __builtin__
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Start-up profiling, enabled by `gui-o-matic --profile-startup`. When
+# enabled, we time every first-time import and each phase wrapped in
+# timed(), and print a report to stderr once the GUI is ready.
+
+REPORT_THRESHOLD = 0.001  # Omit imports faster than this (seconds)
+
+_enabled = False
+_started = time.time()
+_timings = []
+_local = threading.local()
+
+
+def enabled():
+    return _enabled
+
+
+def enable():
+    global _enabled, _started
+    if _enabled:
+        return
+    _enabled, _started = True, time.time()
+    real_import = __builtin__.__import__
+
+    def timed_import(name, *args, **kwargs):
+        if name in sys.modules:
+            return real_import(name, *args, **kwargs)
+        with timed('import %s' % name, imported=True):
+            return real_import(name, *args, **kwargs)
+
+    __builtin__.__import__ = timed_import
+
+
+@contextmanager
+def timed(label, imported=False):
+    if not _enabled:
+        yield
+        return
+    depth = getattr(_local, 'depth', 0)
+    entry = [label, depth, time.time(), None, imported]
+    _timings.append(entry)
+    _local.depth = depth + 1
+    try:
+        yield
+    except:
+        entry[0] += ' (failed)'
+        raise
+    finally:
+        _local.depth = depth
+        entry[3] = time.time() - entry[2]
+
+
+def report(out=None):
+    """Print (once) the timings collected so far."""
+    global _enabled
+    if not _enabled:
+        return
+    _enabled = False
+    out = out or sys.stderr
+    out.write('Start-up profile (ms since start, duration in ms):\n')
+    for label, depth, start, elapsed, imported in _timings:
+        if elapsed is None or (imported and elapsed < REPORT_THRESHOLD):
+            continue
+        out.write('%8.1f %8.1f  %s%s\n' % ((start - _started) * 1000,
+                                          elapsed * 1000,
+                                          '  ' * depth, label))
+    out.write('%8.1f           ready\n' % ((time.time() - _started) * 1000))
+    out.flush()
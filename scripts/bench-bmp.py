@@ -0,0 +1,65 @@
+#!/usr/bin/python
+#
+# Micro-benchmark for the BMP/ICO encoders used by the winapi GUI.
+#
+# Usage: bench-bmp.py [rounds]
+#
+# Compares gui_o_matic.gui.bmpencode against the pil_bmp_fix plugin (for
+# BMP) and PIL's own ICO writer, for typical icon sizes and a full-window
+# background, and checks the BMP output is byte-for-byte identical.
+#
+import io
+import os.path
+import sys
+import time
+
+import PIL.Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from gui_o_matic.gui import bmpencode, pil_bmp_fix
+
+PIL.Image.register_save('BMP+ALPHA', pil_bmp_fix._save)
+
+IMG_DIR = os.path.join(os.path.dirname(__file__), 'img')
+
+
+def pil_save(image, format):
+    buf = io.BytesIO()
+    image.save(buf, format)
+    return buf.getvalue()
+
+
+def bench(encode, image, rounds):
+    start = time.time()
+    for i in range(0, rounds):
+        encode(image)
+    return (time.time() - start) * 1000000.0 / rounds
+
+
+rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+icon = PIL.Image.open(os.path.join(IMG_DIR, 'gt-normal-light.png'))
+wallpaper = PIL.Image.open(os.path.join(IMG_DIR, 'gt-wallpaper.png'))
+images = [('icon %dpx' % s,
+           icon.convert('RGBA').resize((s, s), PIL.Image.ANTIALIAS))
+          for s in (16, 32, 256)]
+images.append(('window %dx%d' % (550, 330),
+               wallpaper.convert('RGBA').resize((550, 330),
+                                                PIL.Image.ANTIALIAS)))
+
+print('%-18s %12s %12s %8s %12s %12s' % ('image', 'BMP+ALPHA us',
+      'bmpencode us', 'same', 'PIL ICO us', 'bmpencode us'))
+for name, image in images:
+    same = (pil_save(image, 'BMP+ALPHA') == bytes(bmpencode.bmp(image)))
+    row = [bench(lambda im: pil_save(im, 'BMP+ALPHA'), image, rounds),
+           bench(bmpencode.bmp, image, rounds)]
+    if max(image.size) <= 256:
+        row += [bench(lambda im: pil_save(im, 'ICO'), image, rounds),
+                bench(lambda im: bmpencode.ico([im]), image, rounds)]
+        print('%-18s %12.1f %12.1f %8s %12.1f %12.1f'
+              % tuple([name] + row[:2] + [same] + row[2:]))
+    else:
+        print('%-18s %12.1f %12.1f %8s %12s %12s'
+              % tuple([name] + row + [same, '-', '-']))
+    if not same:
+        sys.exit(1)
@@ -0,0 +1,47 @@
+#!/usr/bin/python
+#
+# Micro-benchmark for the JSON codecs available to the control protocol.
+#
+# Usage: bench-codec.py [transcript] [rounds]
+#
+# Decodes the arguments of every stage 3 command in a recorded transcript
+# (scripts/transcripts/gui-test.txt by default) with each available codec,
+# and reports how many commands per second each one manages.
+#
+import os.path
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from gui_o_matic.control import codec
+
+
+def load_transcript(path):
+    args = []
+    with open(path, 'r') as fd:
+        for line in fd:
+            line = line.strip()
+            if line and not line.startswith('OK ') and ' ' in line:
+                args.append(line.split(' ', 1)[1])
+    return args
+
+
+def bench(decode, args, rounds):
+    start = time.time()
+    for i in range(0, rounds):
+        for arg in args:
+            decode(arg)
+    return (len(args) * rounds) / (time.time() - start)
+
+
+transcript = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+    os.path.dirname(__file__), 'transcripts', 'gui-test.txt')
+rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+args = load_transcript(transcript)
+print('%d commands x %d rounds from %s' % (len(args), rounds, transcript))
+for name in codec.available_codecs():
+    name, decode = codec.decoder(name)
+    marker = ' (default)' if name == codec.DEFAULT else ''
+    print('%-12s %10.0f commands/s%s' % (name, bench(decode, args, rounds),
+                                          marker))
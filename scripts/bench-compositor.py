@@ -0,0 +1,64 @@
+#!/usr/bin/python
+#
+# Micro-benchmark for the winapi compositor (needs only PIL).
+#
+# Usage: bench-compositor.py [rounds]
+#
+# Builds a main-window-like scene (a background plus a column of status
+# display icons) and compares re-compositing the whole window against
+# re-compositing only the damaged region, when one icon changes.
+#
+import os.path
+import sys
+import time
+
+import PIL.Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from gui_o_matic.gui.compositor import Compositor
+
+IMG_DIR = os.path.join(os.path.dirname(__file__), 'img')
+SIZE = (550, 330)
+BACKGROUND = (255, 255, 255, 255)
+
+
+def load(name, fallback_size):
+    try:
+        return PIL.Image.open(os.path.join(IMG_DIR, name)).convert('RGBA')
+    except IOError:
+        return PIL.Image.new('RGBA', fallback_size, (128, 64, 32, 200))
+
+
+def scene():
+    compositor = Compositor()
+    compositor.add(Compositor.Blend(load('gt-wallpaper.png', SIZE)))
+    icons = [load('gt-%s-light.png' % name, (64, 64))
+             for name in ('normal', 'working', 'attention', 'shutdown')]
+    displays = []
+    for i in range(0, 4):
+        display = Compositor.Blend(icons[i], (10, 10 + i * 70, 74, 74 + i * 70))
+        compositor.add(display)
+        displays.append(display)
+    return compositor, displays, icons
+
+
+def bench(rounds, full):
+    compositor, displays, icons = scene()
+    compositor.composite(SIZE, BACKGROUND)
+    start = time.time()
+    for i in range(0, rounds):
+        displays[i % len(displays)].source = icons[(i + 1) % len(icons)]
+        if full:
+            compositor.invalidate()
+        compositor.composite(SIZE, BACKGROUND)
+    return (time.time() - start) * 1000.0 / rounds
+
+
+rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+print('%dx%d window, one 64x64 icon changed per update, %d rounds'
+      % (SIZE[0], SIZE[1], rounds))
+full = bench(rounds, True)
+damage = bench(rounds, False)
+print('full redraw    %8.3f ms/update' % full)
+print('damaged only   %8.3f ms/update (%.1fx)' % (damage, full / damage))
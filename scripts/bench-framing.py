@@ -0,0 +1,95 @@
+#!/usr/bin/python
+#
+# Micro-benchmark for the stage 3 wire formats: JSON lines, versus the
+# length-prefixed frames of OK LISTEN FRAMED (compact JSON, and MessagePack
+# if it is installed).
+#
+# Usage: bench-framing.py [count]
+#
+# Encodes `count` commands of each kind into one stream, then measures the
+# cost per command of splitting the stream (fed in 64KB chunks, as the
+# event-driven reader does) and decoding each command.
+#
+import json
+import os.path
+import socket
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from gui_o_matic.control import codec
+from gui_o_matic.control.reader import FrameReader, LineReader
+
+CHUNK_SIZE = 64 * 1024
+MARKUP = ('<b>Inbox</b>: 12 new messages\n<i>Last sync: just now</i>\n' * 30)
+
+COMMANDS = {
+    'set_status': ('set_status', {'status': 'working'}),
+    'set_item': ('set_item', {'id': 'item-3', 'label': 'Syncing mail...',
+                              'sensitive': True}),
+    'large display': ('set_status_display', {'id': 'inbox',
+                                             'title': 'Inbox',
+                                             'details': MARKUP})}
+
+
+def encode_lines(command, count):
+    line = '%s %s\n' % (command[0], json.dumps(command[1]))
+    return line * count
+
+
+def encode_frames(payload, count):
+    return (struct.pack('>I', len(payload)) + payload) * count
+
+
+def chunks(data):
+    return [data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+
+
+def bench_lines(data, decode):
+    reader = LineReader(socket.socket())
+    start = time.time()
+    count = 0
+    for chunk in chunks(data):
+        for line in reader.feed(chunk):
+            cmd, args = line.strip().split(' ', 1)
+            decode(args)
+            count += 1
+    return count, time.time() - start
+
+
+def bench_frames(data, decode):
+    reader = FrameReader(socket.socket())
+    start = time.time()
+    count = 0
+    for chunk in chunks(data):
+        for frame in reader.feed(chunk):
+            cmd, args = decode(frame)
+            count += 1
+    return count, time.time() - start
+
+
+count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+json_name, json_decode = codec.decoder()
+
+formats = [('lines (%s)' % json_name, bench_lines, json_decode,
+            lambda c: encode_lines(c, count)),
+           ('framed json', bench_frames, json_decode,
+            lambda c: encode_frames(json.dumps(list(c), separators=(',', ':')),
+                                    count))]
+try:
+    import msgpack
+    formats.append(('framed msgpack', bench_frames,
+                    codec.frame_decoder('msgpack')[1],
+                    lambda c: encode_frames(msgpack.packb(list(c)), count)))
+except ImportError:
+    print('(msgpack is not installed, skipping it)')
+
+print('%-16s %-16s %12s %12s' % ('command', 'format', 'bytes/cmd', 'us/cmd'))
+for name in sorted(COMMANDS.keys()):
+    for label, bench, decode, encode in formats:
+        data = encode(COMMANDS[name])
+        done, elapsed = bench(data, decode)
+        assert done == count
+        print('%-16s %-16s %12d %12.2f' % (name, label, len(data) // count,
+                                          elapsed * 1000000.0 / count))
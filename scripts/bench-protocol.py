@@ -0,0 +1,259 @@
+#!/usr/bin/python
+#
+# Replay benchmark for the GUI-o-Matic control protocol.
+#
+# Feeds recorded or synthetic transcripts through GUIPipeControl.bootstrap
+# (with dry_run) and then GUIPipeControl.run, against a GUI which just
+# records each call. Reports commands per second, p50/p99 dispatch latency
+# (from the control thread picking up a line to the GUI method being
+# called) and peak RSS. Needs no display or GUI toolkit.
+#
+# With --headless, the real headless backend (and its main loop) is used
+# instead, and latency is measured from queueing to applying a command.
+#
+# Examples:
+#
+#    bench-protocol.py                          # all synthetic mixes
+#    bench-protocol.py --mix items -n 100000
+#    bench-protocol.py --transcript transcripts/gui-test.txt --repeat 1000
+#    bench-protocol.py --fail-below 50000       # exit 1 on regression
+#    bench-protocol.py --headless --mix mixed
+#
+import argparse
+import json
+import os.path
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from gui_o_matic.control import GUIPipeControl
+from gui_o_matic.gui.base import BaseGUI
+
+
+STATUSES = ['startup', 'normal', 'working', 'attention', 'shutdown']
+ITEM_IDS = ['item-%d' % i for i in range(0, 10)]
+DISPLAY_IDS = ['display-%d' % i for i in range(0, 5)]
+
+CONFIG = {
+    'app_name': 'Protocol Benchmark',
+    '_prefer_gui': ['__main__'],
+    'images': dict((s, '/tmp/bench-%s.png' % s) for s in STATUSES),
+    'main_window': {
+        'status_displays': [{'id': i, 'title': i} for i in DISPLAY_IDS]},
+    'indicator': {
+        'menu_items': [{'id': i, 'label': i} for i in ITEM_IDS]}}
+
+COMMANDS = {
+    'set_status': lambda r: {
+        'status': r.choice(STATUSES)},
+    'set_item': lambda r: {
+        'id': r.choice(ITEM_IDS),
+        'label': 'Label %d' % r.randint(0, 1000),
+        'sensitive': r.random() > 0.5},
+    'set_status_display': lambda r: {
+        'id': r.choice(DISPLAY_IDS),
+        'title': 'Synced <b>%d</b> messages' % r.randint(0, 100000),
+        'details': 'From imap.example.com\nThis may take a while...'},
+    'notify_user': lambda r: {
+        'message': 'Notification number %d' % r.randint(0, 1000)}}
+
+MIXES = {
+    'status': {'set_status': 1},
+    'items': {'set_item': 1},
+    'displays': {'set_status_display': 1},
+    'notify': {'notify_user': 1},
+    'mixed': {'set_status': 2, 'set_item': 4,
+              'set_status_display': 3, 'notify_user': 1}}
+
+
+class RecordingGUI(BaseGUI):
+    """
+    A GUI which does nothing but record how long each call took to arrive.
+    """
+    control = None
+
+    def __init__(self, config):
+        BaseGUI.__init__(self, config)
+        self.calls = {}
+        self.latencies = []
+
+    def _record(self, method):
+        def record(**kwargs):
+            self.latencies.append(time.time() - self.control.line_started)
+            self.calls[method] = self.calls.get(method, 0) + 1
+        return record
+
+    def run(self):
+        for method in ('set_status', 'set_item', 'set_status_display',
+                       'notify_user', 'update_splash_screen',
+                       'show_splash_screen', 'hide_splash_screen',
+                       'show_main_window', 'hide_main_window'):
+            setattr(self, method, self._record(method))
+        self.ready = True
+
+    def quit(self):
+        pass
+
+GUI = RecordingGUI
+
+
+class BenchControl(GUIPipeControl):
+    line_started = 0
+    lines = 0
+
+    def do_line(self, line):
+        self.line_started = time.time()
+        self.lines += 1
+        return GUIPipeControl.do_line(self, line)
+
+    def _shutdown(self):
+        pass
+
+
+def synthetic(mix, count, seed=0):
+    rand = random.Random(seed)
+    weighted = []
+    for command, weight in MIXES[mix].iteritems():
+        weighted.extend([command] * weight)
+    for i in range(0, count):
+        command = rand.choice(weighted)
+        yield '%s %s\n' % (command, json.dumps(COMMANDS[command](rand)))
+
+
+def recorded(path, repeat):
+    with open(path, 'r') as fd:
+        lines = [l for l in fd if l.strip() and not l.startswith('OK ')]
+    for i in range(0, repeat):
+        for line in lines:
+            yield line
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def bench(commands, event_driven=None, coalesce=True, headless=False):
+    config = dict(CONFIG)
+    if headless:
+        config['_prefer_gui'] = ['headless']
+
+    with tempfile.TemporaryFile() as transcript:
+        transcript.write(json.dumps(config, indent=1) + '\nOK LISTEN\n')
+        for line in commands:
+            transcript.write(line)
+        transcript.seek(0)
+
+        t0 = time.time()
+        control = BenchControl(transcript,
+                               event_driven=event_driven, coalesce=coalesce)
+        control.bootstrap(dry_run=True)
+        t1 = time.time()
+
+        if headless:
+            main_loop = threading.Thread(target=control.gui.run)
+            main_loop.start()
+            control.run()
+            control.gui._sync()
+            t2 = time.time()
+            control.gui.quit()
+            main_loop.join()
+        else:
+            RecordingGUI.control = control
+            control.gui.run()
+            control.run()
+            t2 = time.time()
+
+    gui = control.gui
+    if headless:
+        gui.calls = {}
+        gui.latencies = []
+        for event in gui.events:
+            gui.calls[event['method']] = gui.calls.get(event['method'], 0) + 1
+            gui.latencies.append(event['time'] - event['queued'])
+
+    count = control.lines
+    return {
+        'bootstrap_ms': (t1 - t0) * 1000,
+        'commands': count,
+        'calls': gui.calls,
+        'commands_per_s': count / (t2 - t1),
+        'p50_us': percentile(gui.latencies, 50) * 1000000,
+        'p99_us': percentile(gui.latencies, 99) * 1000000,
+        'coalescer': control.coalescer.stats() if control.coalescer else {},
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Benchmark the GUI-o-Matic '
+                                             'control protocol')
+    ap.add_argument('--mix', choices=sorted(MIXES.keys()), action='append',
+                    help='Synthetic command mix (default: all of them)')
+    ap.add_argument('-n', '--count', type=int, default=50000,
+                    help='Number of synthetic commands per mix')
+    ap.add_argument('--transcript', help='Replay a recorded transcript')
+    ap.add_argument('--repeat', type=int, default=1000,
+                    help='How many times to replay the transcript')
+    ap.add_argument('--readline', action='store_true',
+                    help='Use the readline() loop, not the event reader')
+    ap.add_argument('--no-coalesce', action='store_true',
+                    help='Disable coalescing of redundant updates')
+    ap.add_argument('--headless', action='store_true',
+                    help='Use the headless backend instead of a no-op GUI')
+    ap.add_argument('--fail-below', type=float, default=0,
+                    help='Exit with an error if any run is below this '
+                         'many commands per second')
+    ap.add_argument('--json', action='store_true', help='Output JSON')
+    ap.add_argument('--child', help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    opts = {'event_driven': False if args.readline else None,
+            'coalesce': not args.no_coalesce,
+            'headless': args.headless}
+
+    if args.child:
+        if args.transcript:
+            commands = recorded(args.transcript, args.repeat)
+        else:
+            commands = synthetic(args.child, args.count)
+        print(json.dumps(bench(commands, **opts)))
+        return
+
+    # Run each workload in its own process, so peak RSS is meaningful.
+    workloads = [args.transcript] if args.transcript else (
+        args.mix or sorted(MIXES.keys()))
+    results = {}
+    for workload in workloads:
+        cmd = [sys.executable, __file__, '--child', workload] + [
+            a for a in sys.argv[1:] if a != '--json']
+        results[workload] = json.loads(subprocess.check_output(cmd))
+
+    if args.json:
+        print(json.dumps(results, indent=1))
+    else:
+        print('%-12s %9s %12s %9s %9s %10s %11s' % (
+            'workload', 'commands', 'commands/s', 'p50 us', 'p99 us',
+            'superseded', 'peak RSS kB'))
+        for workload in workloads:
+            r = results[workload]
+            print('%-12s %9d %12.0f %9.1f %9.1f %10d %11d' % (
+                os.path.basename(workload)[:12], r['commands'],
+                r['commands_per_s'], r['p50_us'], r['p99_us'],
+                r['coalescer'].get('superseded', 0), r['peak_rss_kb']))
+
+    slow = [w for w in workloads
+            if results[w]['commands_per_s'] < args.fail_below]
+    if slow:
+        sys.stderr.write('Too slow: %s\n' % ', '.join(slow))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
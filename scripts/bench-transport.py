@@ -0,0 +1,62 @@
+#!/usr/bin/python
+#
+# Throughput benchmark for the control channel transports.
+#
+# Usage: bench-transport.py [count] [line length]
+#
+# For each of OK LISTEN TCP, UNIX and FD (and TO, a plain pipe, for
+# reference), pivots a GUIPipeControl to a child which writes `count`
+# update lines as fast as it can, and measures how quickly the control
+# side reads them, from the connection being made to end of file.
+#
+import os.path
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from gui_o_matic.control import GUIPipeControl
+
+WRITER = ('import socket, sys, os; '
+          'line = \'set_status_display {"id": "x", "detail": "%s"}\\n\'; '
+          'data = line * 1000; '
+          's = %s; '
+          'send = s.sendall if s else sys.stdout.write; '
+          '[send(data) for i in range(0, %d)]')
+
+CONNECT = {
+    'TO': 'None',
+    'TCP': "socket.create_connection(('127.0.0.1', %PORT%))",
+    'UNIX': 'socket.socket(socket.AF_UNIX); s.connect(sys.argv[1])',
+    'FD': 'socket.fromfd(%FD%, socket.AF_UNIX, socket.SOCK_STREAM)'}
+
+
+def bench(transport, count, length):
+    control = GUIPipeControl(sys.stdin, config={}, gui_object=None,
+                             event_driven=True)
+    writer = WRITER % ('x' * length, CONNECT[transport], count // 1000)
+    command = '%s -c "%s"' % (sys.executable, writer.replace('"', '\\"'))
+    if transport == 'UNIX':
+        command += ' %SOCKET%'  # Substituted already quoted for the shell
+
+    start = time.time()
+    control.do_line_magic('OK LISTEN %s: %s' % (transport, command), None)
+    connected = time.time()
+    lines = nbytes = 0
+    while not control.fd.eof:
+        for line in control.fd.read_lines():
+            lines += 1
+            nbytes += len(line)
+    elapsed = time.time() - connected
+    control.child.wait()
+    return connected - start, lines, lines / elapsed, nbytes / elapsed / 1e6
+
+
+count = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+length = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+
+print('%-6s %12s %10s %14s %10s'
+      % ('', 'connect ms', 'lines', 'lines/s', 'MB/s'))
+for transport in ('TO', 'TCP', 'UNIX', 'FD'):
+    connect, lines, rate, mbps = bench(transport, count, length)
+    print('%-6s %12.1f %10d %14.0f %10.1f'
+          % (transport, connect * 1000, lines, rate, mbps))
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+#
+# Correctness check for the BMP/ICO encoders used by the winapi GUI (needs
+# only PIL, so it runs anywhere).
+#
+# Usage: check-bmpencode.py
+#
+# For RGBA, RGB and P images, of even and odd widths:
+#
+#   - BMP output must be byte-for-byte identical to what the pil_bmp_fix
+#     plugin writes for the same image converted to RGBA (as winapi does).
+#   - ICO output must have the layout Windows expects (a directory entry,
+#     a double-height BITMAPINFOHEADER, bottom-up BGRA pixels, then an
+#     all-zero AND mask padded to 32 bits per row), and must decode, both
+#     by hand and with PIL, to the same pixels as PIL's own ICO file.
+#
+# Exits with an error if anything does not match.
+#
+import io
+import os.path
+import struct
+import sys
+
+import PIL.Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from gui_o_matic.gui import bmpencode, dib, pil_bmp_fix
+
+PIL.Image.register_save('BMP+ALPHA', pil_bmp_fix._save)
+
+SIZES = [(1, 1), (7, 5), (16, 16), (31, 17), (33, 33), (48, 48)]
+MODES = ['RGBA', 'RGB', 'P']
+
+
+def sample(mode, size):
+    """A test image with varying colour and alpha in every pixel."""
+    image = PIL.Image.new('RGBA', size)
+    image.putdata([((x * 37) & 255, (y * 53) & 255, (x * y * 7) & 255,
+                    (x * 11 + y * 29) & 255)
+                   for y in range(0, size[1]) for x in range(0, size[0])])
+    if mode == 'P':
+        return image.convert('RGB').convert('P')
+    return image.convert(mode)
+
+
+def pil_save(image, format, **kwargs):
+    buf = io.BytesIO()
+    image.save(buf, format, **kwargs)
+    return buf.getvalue()
+
+
+def check_bmp(image):
+    expected = pil_save(image.convert('RGBA'), 'BMP+ALPHA')
+    if bytes(bmpencode.bmp(image)) != expected:
+        return 'BMP differs from pil_bmp_fix'
+    if dib.bmp_size(expected) != image.size:
+        return 'bmp_size() is wrong'
+
+
+def decode_ico_entry(resource):
+    """Decode a 32-bit DIB icon entry by hand, checking its layout."""
+    (header, width, height, planes, bpp, compression, image_size
+     ) = struct.unpack_from('<IiiHHII', resource, 0)
+    height //= 2
+    xor_size = width * 4 * height
+    and_size = ((width + 31) // 32) * 4 * height
+    if (header, planes, bpp, compression) != (40, 1, 32, 0):
+        raise ValueError('Bad BITMAPINFOHEADER')
+    if image_size != xor_size + and_size or len(resource) != 40 + image_size:
+        raise ValueError('Bad icon data size')
+    if resource[40 + xor_size:] != b'\0' * and_size:
+        raise ValueError('AND mask is not empty')
+    return PIL.Image.frombytes('RGBA', (width, height),
+                               resource[40:40 + xor_size],
+                               'raw', 'BGRA', width * 4, -1)
+
+
+def check_ico(image):
+    if max(image.size) > 256:
+        return
+    ours = bytes(bmpencode.ico([image]))
+    expected = PIL.Image.open(io.BytesIO(
+        pil_save(image.convert('RGBA'), 'ICO', sizes=[image.size])))
+    expected = expected.convert('RGBA').tobytes()
+
+    entries = dib.ico_entries(ours)
+    if len(entries) != 1 or entries[0][:3] != image.size + (32,):
+        return 'ICO directory is wrong: %s' % (entries[0][:3],)
+    try:
+        by_hand = decode_ico_entry(entries[0][3])
+    except ValueError as e:
+        return str(e)
+    if by_hand.tobytes() != expected:
+        return 'ICO pixels differ from PIL (decoded by hand)'
+    if PIL.Image.open(io.BytesIO(ours)).convert('RGBA').tobytes() != expected:
+        return 'ICO pixels differ from PIL (decoded by PIL)'
+
+
+failed = 0
+for mode in MODES:
+    for size in SIZES:
+        image = sample(mode, size)
+        for check in (check_bmp, check_ico):
+            problem = check(image)
+            if problem:
+                failed += 1
+            print('%-5s %-7s %-10s %s' % (mode, '%dx%d' % size,
+                                          check.__name__, problem or 'ok'))
+
+# Several sizes in one ICO file, as winapi could use for small+large icons
+icons = [sample('RGBA', (s, s)) for s in (16, 32, 48)]
+entries = dib.ico_entries(bytes(bmpencode.ico(icons)))
+for icon, entry in zip(icons, entries):
+    if decode_ico_entry(entry[3]).tobytes() != icon.tobytes():
+        failed += 1
+        print('multi-size ICO: %dx%d entry differs' % icon.size)
+
+if failed:
+    print('%d checks FAILED' % failed)
+    sys.exit(1)
+print('All checks passed')